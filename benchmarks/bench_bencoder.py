@@ -0,0 +1,104 @@
+"""
+bdecode 的性能测试，对比逐字节读取的旧实现、纯 python 实现和 fastbencode(如果已安装)。
+机器负载波动较大时多运行几次，取最小值比较。
+
+    python -m benchmarks.bench_bencoder [files] [.torrent ...]
+"""
+import sys
+import timeit
+from io import BytesIO
+
+from utils import bencoder
+from utils.bencoder import bencode, bdecode
+
+
+def legacy_bdecode(_bytes: bytes):
+    fp = BytesIO(_bytes)
+    read = fp.read
+
+    def _bdecode():
+        c = read(1)
+        if c == b'e':
+            return StopIteration
+        elif c == b'i':
+            values = []
+            ch = read(1)
+            while ch != b'e':
+                values.append(ch)
+                ch = read(1)
+            return int(b''.join(values))
+        elif c == b'l':
+            result = []
+            while True:
+                val = _bdecode()
+                if val is StopIteration:
+                    return result
+                result.append(val)
+        elif c == b'd':
+            result = {}
+            while True:
+                key = _bdecode()
+                if key is StopIteration:
+                    return result
+                val = _bdecode()
+                result[key] = val
+        else:
+            size = 0
+            while c != b':':
+                size = size * 10 + (ord(c) - ord('0'))
+                c = read(1)
+            return read(size)
+
+    return _bdecode()
+
+
+def make_torrent(files: int) -> bytes:
+    """
+    生成一个类似 BDMV 原盘的多文件种子
+    """
+    file_list = [
+        {b'length': 1024 ** 2 * (i % 97 + 1) + i, b'path': [b'BDMV', b'STREAM', f'{i:05d}.m2ts'.encode()]}
+        for i in range(files)
+    ]
+    info = {
+        b'files': file_list,
+        b'name': 'Some Anime Vol.1 BDMV'.encode(),
+        b'piece length': 1 << 24,
+        b'pieces': bytes(20) * (files // 4 + 1),
+        b'private': 1,
+    }
+    return bencode({b'announce': b'https://example.com/announce', b'info': info})
+
+
+def bench(name: str, func, data: bytes, number: int):
+    seconds = min(timeit.repeat(lambda: func(data), number=number, repeat=3)) / number
+    print(f'{name:<12}{seconds * 1000:>10.3f} ms')
+    return seconds
+
+
+def main():
+    args = sys.argv[1:]
+    if args and not args[0].isdigit():
+        samples = []
+        for fn in args:
+            with open(fn, 'rb') as fp:
+                samples.append((fn, fp.read()))
+    else:
+        files = int(args[0]) if args else 5000
+        samples = [(f'synthetic torrent with {files} files', make_torrent(files))]
+
+    fast_bdecode = bencoder._fast_bdecode
+    for name, data in samples:
+        assert bdecode(data) == legacy_bdecode(data)
+        number = max(1, 2_000_000 // len(data))
+        print(f'{name}, {len(data)} bytes')
+        legacy = bench('legacy', legacy_bdecode, data, number)
+        python = bench('python', lambda _data: bencoder._decode(_data, 0)[0], data, number)
+        print(f'{"":<12}{legacy / python:>10.1f} x')
+        if fast_bdecode is not None:
+            fast = bench('fastbencode', bdecode, data, number)
+            print(f'{"":<12}{legacy / fast:>10.1f} x')
+
+
+if __name__ == '__main__':
+    main()
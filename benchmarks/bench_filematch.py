@@ -0,0 +1,162 @@
+"""
+多文件种子匹配的性能测试，对比原来逐个替换路径、在列表中查找的实现和 utils.filematch。
+生成若干张 BDMV 原盘组成的合集，本地的根文件夹和其中一张盘的文件夹被改过名字，部分文件体积相同。
+
+    python -m benchmarks.bench_filematch [文件数 ...] [--legacy]
+
+默认只在不超过 2000 个文件时运行旧实现，--legacy 强制运行。
+"""
+import os
+import random
+import sys
+import time
+from typing import Mapping
+
+from utils.filematch import match_files
+
+MAX_MISSING_SIZE = 1024 ** 3
+
+
+def decode_name(name: bytes) -> str:
+    return name.decode('utf-8', 'replace')
+
+
+def legacy_map(path: str, name: str, file_list: list[str], torrent_files: list[dict[bytes, int | list[bytes]]],
+               sizes: Mapping[str, int], max_missing_size: int) -> dict[str, str]:
+    folder_name_map = {}
+    base_path, folder_name = os.path.split(path)
+
+    local_files_size_to_path = {sizes[path]: path for path in file_list}
+    torrent_files.sort(key=lambda x: x[b'length'], reverse=True)
+
+    unmatch_size = 0
+    for torrent_file in torrent_files:
+        if (size := torrent_file[b'length']) not in local_files_size_to_path:
+            unmatch_size += size
+            if unmatch_size > max_missing_size:
+                return {}
+
+    for torrent_file in torrent_files:
+        if (size := torrent_file[b'length']) in local_files_size_to_path:
+            if size > 4 * 1024 ** 2:
+
+                missing_size = 0
+                for _torrent_file in torrent_files:
+                    _torrent_file_path = os.path.join(base_path, name, *list(map(decode_name, _torrent_file[b'path'])))
+                    for key, val in folder_name_map.items():
+                        _torrent_file_path = _torrent_file_path.replace(key, val)
+                    if _torrent_file_path not in file_list:
+                        missing_size += _torrent_file[b'length']
+                if missing_size == unmatch_size:
+                    legacy_remove_files(base_path, name, file_list, torrent_files, folder_name_map)
+                    return folder_name_map
+
+                local_file_path = local_files_size_to_path[size][len(base_path) + 1:]
+                torrent_file_path = os.path.join(name, *list(map(decode_name, torrent_file[b'path'])))
+
+                for key, val in folder_name_map.items():
+                    torrent_file_path = torrent_file_path.replace(key, val)
+
+                if local_file_path == torrent_file_path:
+                    continue
+                else:
+                    flag = False
+                    for _torrent_file in torrent_files:
+                        _torrent_file_path = os.path.join(name, *list(map(decode_name, _torrent_file[b'path'])))
+                        if _torrent_file_path == local_file_path and _torrent_file[b'length'] == size:
+                            flag = True
+                    if flag:
+                        continue
+
+                separator = '\\' if sys.platform == 'win32' else '/'
+
+                local_file_path_list = local_file_path.split(separator)
+                torrent_file_path_list = torrent_file_path.split(separator)
+
+                is_file = True
+                for i in range(min(len(local_file_path_list), len(torrent_file_path_list)) - 1):
+                    if local_file_path_list[-1] == torrent_file_path_list[-1]:
+                        is_file = False
+                        local_file_path_list.pop(-1)
+                        torrent_file_path_list.pop(-1)
+                    else:
+                        break
+
+                torrent_folder = separator.join(torrent_file_path_list)
+                local_folder = separator.join(local_file_path_list)
+                if not is_file:
+                    torrent_folder += separator
+                    local_folder += separator
+
+                if torrent_folder not in folder_name_map:
+                    folder_name_map[torrent_folder] = local_folder
+
+    legacy_remove_files(base_path, name, file_list, torrent_files, folder_name_map)
+    return folder_name_map
+
+
+def legacy_remove_files(base_path, name, file_list, torrent_files, folder_name_map):
+    for _torrent_file in torrent_files:
+        _torrent_file_path = os.path.join(base_path, name, *list(map(decode_name, _torrent_file[b'path'])))
+        for key, val in folder_name_map.items():
+            _torrent_file_path = _torrent_file_path.replace(key, val)
+        if _torrent_file_path in file_list:
+            file_list.remove(_torrent_file_path)
+
+
+def make_tree(n_files: int, seed: int = 0) -> tuple[str, str, list[dict], dict[str, int]]:
+    """
+    返回 (本地文件夹, 种子名字, 种子 info 中的 files, 本地文件路径 -> 体积)
+    """
+    rng = random.Random(seed)
+    files_per_disc = 500
+    torrent_files = []
+    sizes = {}
+    path = os.path.join(os.sep, 'data', 'Local Collection')
+    name = 'Collection [BDMV]'
+    for disc in range((n_files + files_per_disc - 1) // files_per_disc):
+        disc_name = f'DISC{disc + 1}'
+        local_disc = f'Vol.{disc + 1}' if disc == 1 else disc_name
+        for i in range(min(files_per_disc, n_files - disc * files_per_disc)):
+            if i < 40:
+                # 每张盘的正片和特典，第一张盘之后有的文件体积和第一张盘相同
+                sub, file_name = ['BDMV', 'STREAM'], f'{i:05d}.m2ts'
+                size = (rng.randint(5, 30000) if disc == 0 or i % 4 else 1000 + i) * 1024 ** 2 + rng.randint(0, 4095)
+            else:
+                sub, file_name = ['BDMV', 'CLIPINF'], f'{i:05d}.clpi'
+                size = rng.randint(100, 4096)
+            torrent_files.append({b'length': size,
+                                  b'path': [part.encode() for part in (disc_name, *sub, file_name)]})
+            sizes[os.path.join(path, local_disc, *sub, file_name)] = size
+    return path, name, torrent_files, sizes
+
+
+def run(n_files: int, legacy: bool):
+    path, name, torrent_files, sizes = make_tree(n_files)
+    print(f'{n_files} files:')
+
+    start = time.perf_counter()
+    file_list = list(sizes)
+    match = match_files(path, name, file_list, sizes, [dict(file) for file in torrent_files], decode_name)
+    elapsed = time.perf_counter() - start
+    print(f'  filematch  {elapsed * 1e3:10.1f} ms  {len(match.matched)} matched, '
+          f'{match.missing_size} bytes missing, renames {match.renames}')
+
+    if legacy:
+        start = time.perf_counter()
+        file_list = list(sizes)
+        renames = legacy_map(path, name, file_list, [dict(file) for file in torrent_files], sizes, MAX_MISSING_SIZE)
+        elapsed = time.perf_counter() - start
+        print(f'  legacy     {elapsed * 1e3:10.1f} ms  {len(sizes) - len(file_list)} matched, renames {renames}')
+
+
+def main():
+    args = sys.argv[1:]
+    force_legacy = '--legacy' in args
+    counts = [int(arg) for arg in args if arg != '--legacy'] or [1000, 2000, 10000]
+    for n_files in counts:
+        run(n_files, force_legacy or n_files <= 2000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+种子列表页解析的性能测试，对比原来基于 BeautifulSoup 的实现和 web.listing。
+
+    python -m benchmarks.bench_parse_page [保存的 torrents.php 页面 ...]
+
+不指定页面时生成一个和 U2 列表页结构相同的页面(100 行，其中 2 行置顶)。
+"""
+import random
+import sys
+import time
+
+from web.listing import parse_listing
+
+
+def legacy_parse_page(page: str):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page.replace('\n', ''), 'lxml')
+    table = soup.select('table.torrents')[0]
+    for tr in table.contents[1:]:
+        if 'sticky' not in str(tr):
+            yield int(tr.contents[1].a['href'][15:-6])
+
+
+def make_page(rows: int = 100, sticky: int = 2, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>种子</title></head><body>',
+             '<table class="torrents" cellspacing="0" cellpadding="5" width="100%">\n<tr>',
+             ''.join(f'<td class="colhead">{name}</td>' for name in ('类型', '标题', '评论', '存活时间', '大小', '种子数',
+                                                                     '下载数', '完成数', '发布者')),
+             '</tr>\n']
+    tid = 60000
+    for i in range(rows):
+        tid -= rng.randint(1, 3)
+        is_sticky = i < sticky
+        size = rng.uniform(1, 1000)
+        unit = rng.choice(('MiB', 'GiB', 'TiB'))
+        title = ''.join(rng.choice('動画アニメ映画原盘合集字幕') for _ in range(rng.randint(10, 40)))
+        parts.append(
+            f'<tr{" class=sticky_bg" if is_sticky else ""}>\n'
+            f'<td class="rowfollow nowrap" valign="middle" style="padding: 0px">'
+            f'<a href="?cat=12"><img class="c_anime" src="pic/cattrans.gif" alt="Anime" title="Anime" /></a></td>\n'
+            f'<td class="rowfollow" width="100%" align="left"><table class="torrentname" width="100%"><tr>'
+            f'<td class="embedded">{"<img class=sticky src=pic/trans.gif alt=Sticky />" if is_sticky else ""}'
+            f'<a title="{title}" href="details.php?id={tid}&amp;hit=1"><b>{title}</b></a><br />'
+            f'<span class="tooltip">{title} [BDRip 1080p]</span></td>'
+            f'<td width="20" class="embedded" style="text-align: right;">'
+            f'<a href="download.php?id={tid}"><img class="download" src="pic/trans.gif" alt="download" /></a></td>'
+            f'</tr></table></td>\n'
+            f'<td class="rowfollow"><a href="comment.php?action=add&amp;pid={tid}&amp;type=torrent">0</a></td>\n'
+            f'<td class="rowfollow nowrap"><span title="2024-01-01 00:00:00">{rng.randint(1, 30)}天<br />'
+            f'{rng.randint(0, 23)}时</span></td>\n'
+            f'<td class="rowfollow">{size:.2f}<br />{unit}</td>\n'
+            f'<td class="rowfollow" align="center"><b><a href="details.php?id={tid}&amp;hit=1&amp;dllist=1#seeders">'
+            f'{rng.randint(1, 200)}</a></b></td>\n'
+            f'<td class="rowfollow">{rng.randint(0, 20)}</td>\n'
+            f'<td class="rowfollow"><a href="viewsnatches.php?id={tid}"><b>{rng.randint(0, 2000)}</b></a></td>\n'
+            f'<td class="rowfollow"><i>匿名</i></td>\n</tr>\n')
+    parts.append('</table></body></html>')
+    return ''.join(parts).encode()
+
+
+def bench(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(name: str, page: bytes, repeat: int = 20):
+    tids = [row.tid for row in parse_listing(page) if not row.sticky]
+    legacy_tids = list(legacy_parse_page(page.decode('utf-8', 'replace')))
+    print(f'{name}: {len(page)} bytes, {len(tids)} torrents, same result: {tids == legacy_tids}')
+    elapsed = bench(lambda: list(legacy_parse_page(page.decode('utf-8', 'replace'))), repeat)
+    print(f'  soup   {elapsed * 1e3:8.2f} ms/page')
+    elapsed = bench(lambda: [row.tid for row in parse_listing(page) if not row.sticky], repeat)
+    print(f'  lxml   {elapsed * 1e3:8.2f} ms/page')
+
+
+def main():
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as fp:
+                run(path, fp.read())
+    else:
+        run('generated', make_page())
+
+
+if __name__ == '__main__':
+    main()
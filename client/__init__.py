@@ -1,2 +1,9 @@
-from client.deluge import Deluge
-from client.qb import Qbittorrent
+def __getattr__(name):
+    # 客户端依赖 aiohttp 或 deluge_client，导入较慢，只在用到时导入
+    if name == 'Deluge':
+        from client.deluge import Deluge
+        return Deluge
+    if name == 'Qbittorrent':
+        from client.qb import Qbittorrent
+        return Qbittorrent
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,10 +1,20 @@
 from abc import ABCMeta, abstractmethod
+from typing import NamedTuple
+
+from utils.torrent import Torrent
+
+
+class TorrentStatus(NamedTuple):
+    progress: float  # 0 到 1
+    checking: bool  # 是否正在校验或者排队等待校验
 
 
 class BTClient(metaclass=ABCMeta):
+    # 实现了 recheck、resume 和 get_progress 的客户端为 True，否则不会创建校验调度
+    supports_recheck = False
 
     @abstractmethod
-    def rename_file(self, torrent_hash: str, old_path: str, new_path: str):
+    async def rename_file(self, torrent_hash: str, old_path: str, new_path: str):
         """
         重命名文件
 
@@ -14,8 +24,19 @@ class BTClient(metaclass=ABCMeta):
             new_path: 新的文件名
         """
 
+    async def rename_files(self, torrent_hash: str, renames: list[tuple[str, str]]):
+        """
+        批量重命名同一个种子里的文件，客户端支持时只需要一次请求
+
+        Args:
+            torrent_hash: 种子 hash
+            renames: (原文件名, 新的文件名) 列表
+        """
+        for old_path, new_path in renames:
+            await self.rename_file(torrent_hash, old_path, new_path)
+
     @abstractmethod
-    def rename_folder(self, torrent_hash: str, old_folder: str, new_folder: str):
+    async def rename_folder(self, torrent_hash: str, old_folder: str, new_folder: str):
         """
         重命名文件夹
 
@@ -26,17 +47,47 @@ class BTClient(metaclass=ABCMeta):
 
         """
 
-    def get_hashes(self):
+    async def get_hashes(self):
         """
         返回客户端所有种子 hash 的集合
         """
 
-    def add_torrent(self, torrent_files, save_path, is_paused):
+    async def add_torrent(self, torrent: Torrent, save_path, is_paused):
         """
         添加种子
 
         Args:
-            torrent_files: 种子文件内容
+            torrent: 解码后的种子
             save_path: 保存路径
             is_paused: 是否添加后暂停
-        """
\ No newline at end of file
+        """
+
+    async def add_torrents(self, torrents: list[Torrent], save_path, is_paused):
+        """
+        批量添加保存路径相同的种子，客户端支持时只需要一次请求
+        """
+        for torrent in torrents:
+            await self.add_torrent(torrent, save_path, is_paused)
+
+    async def recheck(self, torrent_hashes: list[str]):
+        """
+        强制重新校验种子
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support recheck')
+
+    async def resume(self, torrent_hashes: list[str]):
+        """
+        开始(继续)种子
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support resume')
+
+    async def get_progress(self, torrent_hashes: list[str]) -> dict[str, TorrentStatus]:
+        """
+        批量查询种子的进度和是否在校验，客户端中没有的种子不返回
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support get_progress')
+
+    async def close(self):
+        """
+        关闭与客户端的连接
+        """
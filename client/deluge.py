@@ -1,33 +1,115 @@
+import asyncio
 from base64 import b64encode
-from hashlib import sha1
 
-from client.btclient import BTClient
-from utils.bencoder import bdecode, bencode
+from client.btclient import BTClient, TorrentStatus
+from utils.torrent import Torrent
 
 from deluge_client import LocalDelugeRPCClient
 
 
+class DelugeRPCPool:
+    """
+    deluge daemon 的 RPC 连接池。一个连接同一时间只能有一个调用，调用在线程中执行，
+    不同的调用使用不同的连接，连接建立后一直复用
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str, size: int = 2):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.created = 0
+        self.idle = asyncio.Queue()  # type: asyncio.Queue[LocalDelugeRPCClient]
+
+    def connect(self) -> LocalDelugeRPCClient:
+        client = LocalDelugeRPCClient(host=self.host, port=self.port, username=self.username, password=self.password)
+        client.connect()
+        return client
+
+    async def call(self, method: str, *args, **kwargs):
+        if self.idle.empty() and self.created < self.size:
+            self.created += 1
+            try:
+                client = await asyncio.to_thread(self.connect)
+            except Exception:
+                self.created -= 1
+                raise
+        else:
+            client = await self.idle.get()
+        try:
+            return await asyncio.to_thread(client.call, method, *args, **kwargs)
+        finally:
+            self.idle.put_nowait(client)
+
+    async def close(self):
+        while not self.idle.empty():
+            await asyncio.to_thread(self.idle.get_nowait().disconnect)
+        self.created = 0
+
+
 class Deluge(BTClient):
-    def __init__(self, client: LocalDelugeRPCClient):
-        self.client = client
-
-    def rename_file(self, torrent_hash: str, old_path: str, new_path: str):
-        for file in self.client.core.get_torrent_status(torrent_hash, ['files'])['files']:
-            if file['path'] == old_path:
-                file_id = file['index']
-                self.client.core.rename_files(torrent_id=torrent_hash, filenames=[(file_id, new_path)])
-                break
-
-    def rename_folder(self, torrent_hash: str, old_folder: str, new_folder: str):
-        self.client.core.rename_folder(torrent_id=torrent_hash, folder=old_folder, new_folder=new_folder)
-
-    def get_hashes(self):
-        return set(self.client.core.get_session_state())
-
-    def add_torrent(self, torrent_files, save_path, is_paused):
-        info_hash = sha1(bencode(bdecode(torrent_files)[b'info'])).hexdigest()
-        self.client.core.add_torrent_file(
-            f'{info_hash}.torrent',
-            b64encode(torrent_files),
+    supports_recheck = True
+
+    def __init__(self, host: str, port: int, username: str, password: str, connections: int = 2):
+        self.pool = DelugeRPCPool(host, port, username, password, connections)
+        self.file_index = {}  # type: dict[str, dict[str, int]]
+
+    async def get_file_index(self, torrent_hash: str) -> dict[str, int]:
+        """
+        返回种子中 文件路径 -> 文件 id 的映射，重命名之前只查询一次
+        """
+        if (file_index := self.file_index.get(torrent_hash)) is None:
+            status = await self.pool.call('core.get_torrent_status', torrent_hash, ['files'])
+            file_index = self.file_index[torrent_hash] = {file['path']: file['index'] for file in status['files']}
+        return file_index
+
+    async def rename_file(self, torrent_hash: str, old_path: str, new_path: str):
+        await self.rename_files(torrent_hash, [(old_path, new_path)])
+
+    async def rename_files(self, torrent_hash: str, renames: list[tuple[str, str]]):
+        file_index = await self.get_file_index(torrent_hash)
+        filenames = [(file_index[old_path], new_path) for old_path, new_path in renames if old_path in file_index]
+        if filenames:
+            await self.pool.call('core.rename_files', torrent_id=torrent_hash, filenames=filenames)
+            for old_path, new_path in renames:
+                if (index := file_index.pop(old_path, None)) is not None:
+                    file_index[new_path] = index
+
+    async def rename_folder(self, torrent_hash: str, old_folder: str, new_folder: str):
+        await self.pool.call('core.rename_folder', torrent_id=torrent_hash, folder=old_folder, new_folder=new_folder)
+        self.file_index.pop(torrent_hash, None)
+
+    async def get_hashes(self):
+        # get_session_state 本身只返回 hash 列表，不需要增量同步
+        return set(await self.pool.call('core.get_session_state'))
+
+    async def add_torrent(self, torrent: Torrent, save_path, is_paused):
+        await self.pool.call(
+            'core.add_torrent_file',
+            f'{torrent.info_hash}.torrent',
+            b64encode(torrent.content),
             {'add_paused': is_paused, 'download_location': save_path}
         )
+
+    async def add_torrents(self, torrents: list[Torrent], save_path, is_paused):
+        options = {'add_paused': is_paused, 'download_location': save_path}
+        await self.pool.call(
+            'core.add_torrent_files',
+            [(f'{torrent.info_hash}.torrent', b64encode(torrent.content), options) for torrent in torrents]
+        )
+
+    async def recheck(self, torrent_hashes):
+        await self.pool.call('core.force_recheck', torrent_hashes)
+
+    async def resume(self, torrent_hashes):
+        await self.pool.call('core.resume_torrents', torrent_hashes)
+
+    async def get_progress(self, torrent_hashes):
+        status = await self.pool.call('core.get_torrents_status', {'id': torrent_hashes}, ['progress', 'state'])
+        # deluge 的进度是百分比
+        return {torrent_hash: TorrentStatus(torrent['progress'] / 100, torrent['state'] == 'Checking')
+                for torrent_hash, torrent in status.items()}
+
+    async def close(self):
+        await self.pool.close()
@@ -0,0 +1,127 @@
+"""
+辅种计划：扫描和匹配的结果，记录要添加的种子、保存路径和添加后的重命名操作。
+
+plan 模式下用 PlanRecorder 代替客户端，匹配流程不变，对客户端的写操作都只记录下来，最后写入计划文件；
+apply 模式读取计划文件，批量添加种子并执行重命名。已经完成的种子记录在 ``<计划文件>.done`` 中，
+中断后再次执行会跳过，所以可以放心重复执行。没有全部完成的种子每完成一个操作记录一行 ``<hash> <已完成的操作数>``，
+再次执行时从下一个操作继续，已经重命名过的文件不会再重命名一次(原路径已经不存在，会失败)。
+"""
+import json
+import os
+import time
+from typing import Any, Optional
+
+from loguru import logger
+
+from client.btclient import BTClient
+from utils.torrent import Torrent
+
+PLAN_VERSION = 1
+
+
+class PlanEntry:
+    """
+    Attributes:
+        info_hash: 种子 hash
+        tid: 种子 id，0 表示只能从 torrents_folder 或者缓存中读取
+        save_path: 保存路径
+        paused: 添加后是否暂停
+        ops: 添加后按顺序执行的操作，元素为 ['rename_file', 原路径, 新路径]、['rename_folder', 原路径, 新路径]
+            或 ['rename_files', [[原路径, 新路径], ...]]
+    """
+    __slots__ = ('info_hash', 'tid', 'save_path', 'paused', 'ops')
+
+    def __init__(self, info_hash: str, tid: int, save_path: str, paused: bool, ops: Optional[list[list]] = None):
+        self.info_hash = info_hash
+        self.tid = tid
+        self.save_path = save_path
+        self.paused = paused
+        self.ops = ops if ops is not None else []
+
+    def to_json(self) -> list:
+        return [self.info_hash, self.tid, self.save_path, self.paused, self.ops]
+
+    @classmethod
+    def from_json(cls, data: list) -> 'PlanEntry':
+        return cls(*data)
+
+
+def save_plan(path: str, entries: list[PlanEntry], **meta: Any):
+    plan = {'version': PLAN_VERSION, 'time': int(time.time()), **meta,
+            'torrents': [entry.to_json() for entry in entries]}
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as fp:
+        json.dump(plan, fp, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+
+
+def load_plan(path: str) -> list[PlanEntry]:
+    with open(path, 'r', encoding='utf-8') as fp:
+        plan = json.load(fp)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'Unsupported plan version {plan.get("version")}')
+    return [PlanEntry.from_json(data) for data in plan['torrents']]
+
+
+def load_done(path: str) -> tuple[set[str], dict[str, int]]:
+    """
+    返回已经完成的种子，以及没有全部完成的种子已经完成的操作数
+    """
+    done = set()
+    progress = {}
+    if not os.path.exists(f'{path}.done'):
+        return done, progress
+    with open(f'{path}.done', 'r') as fp:
+        for line in fp:
+            info_hash, _, ops = line.strip().partition(' ')
+            if not info_hash:
+                continue
+            if ops:
+                progress[info_hash] = max(progress.get(info_hash, 0), int(ops))
+            else:
+                done.add(info_hash)
+    return done, progress
+
+
+def mark_done(path: str, info_hashes: list[str]):
+    with open(f'{path}.done', 'a') as fp:
+        fp.writelines(f'{info_hash}\n' for info_hash in info_hashes)
+
+
+def mark_progress(path: str, info_hash: str, ops: int):
+    with open(f'{path}.done', 'a') as fp:
+        fp.write(f'{info_hash} {ops}\n')
+
+
+class PlanRecorder(BTClient):
+    """
+    只记录写操作的客户端。可以传入真正的客户端，用来获取已有的种子 hash，连接不上时当作客户端里没有种子
+    """
+
+    def __init__(self, client: Optional[BTClient] = None):
+        self.client = client
+        self.entries = {}  # type: dict[str, PlanEntry]
+
+    async def rename_file(self, torrent_hash, old_path, new_path):
+        self.entries[torrent_hash].ops.append(['rename_file', old_path, new_path])
+
+    async def rename_files(self, torrent_hash, renames):
+        self.entries[torrent_hash].ops.append(['rename_files', [list(rename) for rename in renames]])
+
+    async def rename_folder(self, torrent_hash, old_folder, new_folder):
+        self.entries[torrent_hash].ops.append(['rename_folder', old_folder, new_folder])
+
+    async def get_hashes(self):
+        if self.client is None:
+            return set()
+        try:
+            return await self.client.get_hashes()
+        except Exception as e:
+            logger.warning(f'Cannot get torrents in client, plan may contain torrents already added: {e}')
+            return set()
+
+    async def add_torrent(self, torrent: Torrent, save_path, is_paused):
+        self.entries[torrent.info_hash] = PlanEntry(torrent.info_hash, 0, save_path, is_paused)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
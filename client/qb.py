@@ -1,27 +1,197 @@
-from client.btclient import BTClient
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Optional
 
-import qbittorrentapi
+import aiohttp
+from yarl import URL
+
+from client.btclient import BTClient, TorrentStatus
+from utils.torrent import Torrent
 
 
 class Qbittorrent(BTClient):
-    def __init__(self, client: qbittorrentapi.Client):
-        self.client = client
+    """
+    直接通过 aiohttp 调用 qBittorrent WebUI API，所有请求共用一个会话和连接池
+    """
+
+    supports_recheck = True
 
-    def rename_file(self, torrent_hash, old_path, new_path):
-        self.client.torrents_rename_file(torrent_hash=torrent_hash, old_path=old_path, new_path=new_path)
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 sync_state_path: Optional[str] = None):
+        """
+        Args:
+            sync_state_path: 保存 sync/maindata 的 rid、会话 cookie 和种子 hash 的文件，下次运行时只获取增量。
+                默认为 resources/qb_sync_<地址>_<端口>.json，每个客户端一个文件；为空字符串时不保存
+        """
+        if not host.startswith(('http://', 'https://')):
+            host = f'http://{host}'
+        self.base_url = f'{host}:{port}/api/v2'
+        if sync_state_path is None:
+            sync_state_path = f'resources/qb_sync_{re.sub(r"[^0-9A-Za-z.-]+", "_", f"{host}_{port}")}.json'
+        self.username = username
+        self.password = password
+        self.session = None  # type: Optional[aiohttp.ClientSession]
+        self.logged_in = False
+        self.login_lock = asyncio.Lock()
+        self.sync_state_path = sync_state_path
+        self.rid = 0
+        self.hashes = set()  # type: set[str]
+        self.saved_sid = None  # type: Optional[str]
+        self.resume_path = 'torrents/resume'
+        self.load_sync_state()
 
-    def rename_folder(self, torrent_hash, old_folder, new_folder):
+    def load_sync_state(self):
+        if not self.sync_state_path or not os.path.exists(self.sync_state_path):
+            return
         try:
-            self.client.torrents_rename_folder(torrent_hash, old_path=old_folder, new_path=new_folder)
-        except:
-            for file in self.client.torrents_files(torrent_hash):
-                old_name = file.name
+            with open(self.sync_state_path, 'r') as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if state.get('base_url') == self.base_url:
+            self.rid = state['rid']
+            self.hashes = set(state['hashes'])
+            self.saved_sid = state['sid']
+
+    def save_sync_state(self):
+        if not self.sync_state_path or self.session is None:
+            return
+        sid = self.session.cookie_jar.filter_cookies(URL(self.base_url)).get('SID')
+        state = {'base_url': self.base_url, 'sid': sid and sid.value, 'rid': self.rid,
+                 'time': int(time.time()), 'hashes': list(self.hashes)}
+        with open(f'{self.sync_state_path}.tmp', 'w') as fp:
+            json.dump(state, fp)
+        os.replace(f'{self.sync_state_path}.tmp', self.sync_state_path)
+
+    def create_session(self):
+        # unsafe=True 才会保存 ip 地址的 cookie
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8),
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True))
+        if self.saved_sid:
+            # 复用上次的会话，rid 才有效，会话过期时会重新登录
+            self.session.cookie_jar.update_cookies({'SID': self.saved_sid}, URL(self.base_url).origin())
+            self.saved_sid = None
+            self.logged_in = True
+
+    async def login(self):
+        async with self.session.post(
+                f'{self.base_url}/auth/login', data={'username': self.username, 'password': self.password}
+        ) as resp:
+            resp.raise_for_status()
+            if (await resp.text()).strip() != 'Ok.':
+                raise PermissionError('qBittorrent login failed')
+        # 新的会话里服务端没有之前的 rid，需要从头同步
+        self.rid = 0
+        self.logged_in = True
+
+    async def request(self, method: str, path: str, **kwargs) -> aiohttp.ClientResponse:
+        """
+        发送请求并读取响应内容，未登录或登录过期(403)时先登录。
+        FormData 只能发送一次，参数也可能依赖登录状态，所以 data 和 params 可以传入函数，每次发送时生成
+        """
+        data = kwargs.pop('data', None)
+        params = kwargs.pop('params', None)
+        if self.session is None:
+            self.create_session()
+        for retry in range(2):
+            if not self.logged_in:
+                async with self.login_lock:
+                    if not self.logged_in:
+                        await self.login()
+            async with self.session.request(method, f'{self.base_url}/{path}',
+                                            data=data() if callable(data) else data,
+                                            params=params() if callable(params) else params, **kwargs) as resp:
+                if resp.status == 403 and not retry:
+                    self.logged_in = False
+                    continue
+                resp.raise_for_status()
+                await resp.read()
+                return resp
+
+    async def rename_file(self, torrent_hash, old_path, new_path):
+        await self.request('POST', 'torrents/renameFile',
+                           data={'hash': torrent_hash, 'oldPath': old_path, 'newPath': new_path})
+
+    async def rename_files(self, torrent_hash, renames):
+        # WebUI API 没有批量重命名的接口，同一个连接池里并发发送
+        await asyncio.gather(*(self.rename_file(torrent_hash, old_path, new_path) for old_path, new_path in renames))
+
+    async def rename_folder(self, torrent_hash, old_folder, new_folder):
+        try:
+            await self.request('POST', 'torrents/renameFolder',
+                               data={'hash': torrent_hash, 'oldPath': old_folder, 'newPath': new_folder})
+        except aiohttp.ClientResponseError as e:
+            # 旧版本没有 renameFolder(404/405)，逐个文件按 id 重命名；其他错误(409 路径冲突等)直接抛出
+            if e.status not in (404, 405):
+                raise
+            resp = await self.request('GET', 'torrents/files', params={'hash': torrent_hash})
+            for i, file in enumerate(await resp.json()):
+                old_name = file['name']
                 new_name = old_name.replace(old_folder, new_folder)
                 if old_name != new_name:
-                    self.client.torrents_rename_file(torrent_hash=torrent_hash, file_id=file.index, new_file_name=new_name)
+                    await self.request('POST', 'torrents/renameFile',
+                                       data={'hash': torrent_hash, 'id': str(file.get('index', i)), 'name': new_name})
+
+    async def get_hashes(self):
+        """
+        通过 sync/maindata 增量同步种子 hash，第一次(或者会话过期后)是全量数据，之后只有变化的种子
+        """
+        resp = await self.request('GET', 'sync/maindata', params=lambda: {'rid': str(self.rid)})
+        data = await resp.json()
+        if data.get('full_update'):
+            self.hashes = set(data.get('torrents', ()))
+        else:
+            self.hashes.update(data.get('torrents', ()))
+            self.hashes.difference_update(data.get('torrents_removed', ()))
+        self.rid = data['rid']
+        self.save_sync_state()
+        return set(self.hashes)
+
+    async def add_torrent(self, torrent: Torrent, save_path, is_paused):
+        await self.add_torrents([torrent], save_path, is_paused)
+
+    async def add_torrents(self, torrents: list[Torrent], save_path, is_paused):
+        def form_data():
+            data = aiohttp.FormData()
+            for torrent in torrents:
+                data.add_field('torrents', torrent.content, filename=f'{torrent.info_hash}.torrent',
+                               content_type='application/x-bittorrent')
+            data.add_field('savepath', save_path)
+            # qBittorrent 5.0 把 paused 改名为 stopped
+            data.add_field('paused', 'true' if is_paused else 'false')
+            data.add_field('stopped', 'true' if is_paused else 'false')
+            return data
+
+        resp = await self.request('POST', 'torrents/add', data=form_data)
+        # 一个都没有添加成功时返回 Fails.，部分成功时也返回 Ok.
+        if (await resp.text()).strip() == 'Fails.':
+            raise RuntimeError(f'qBittorrent rejected {len(torrents)} torrents -> {save_path}')
+
+    async def recheck(self, torrent_hashes):
+        await self.request('POST', 'torrents/recheck', data={'hashes': '|'.join(torrent_hashes)})
+
+    async def resume(self, torrent_hashes):
+        try:
+            await self.request('POST', self.resume_path, data={'hashes': '|'.join(torrent_hashes)})
+        except aiohttp.ClientResponseError as e:
+            # qBittorrent 5.0 把 resume 改名为 start
+            if e.status != 404 or self.resume_path == 'torrents/start':
+                raise
+            self.resume_path = 'torrents/start'
+            await self.request('POST', self.resume_path, data={'hashes': '|'.join(torrent_hashes)})
 
-    def get_hashes(self):
-        return {torrent.hash for torrent in self.client.torrents_info()}
+    async def get_progress(self, torrent_hashes):
+        resp = await self.request('GET', 'torrents/info', params={'hashes': '|'.join(torrent_hashes)})
+        return {torrent['hash']: TorrentStatus(torrent['progress'], torrent['state'].startswith('checking')
+                                               or torrent['state'] == 'queuedForChecking')
+                for torrent in await resp.json()}
 
-    def add_torrent(self, torrent_files, save_path, is_paused):
-        self.client.torrents_add(torrent_files=torrent_files, save_path=save_path, is_paused=True)
+    async def close(self):
+        if self.session is not None:
+            self.save_sync_state()
+            await self.session.close()
+            self.session = None
+            self.logged_in = False
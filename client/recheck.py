@@ -0,0 +1,166 @@
+"""
+添加并重命名之后的校验调度：按磁盘分组，每个磁盘同时校验的种子数和总体积不超过限制，
+校验完成、进度为 100% 的种子自动开始做种，没有校验完整的保持暂停，留给用户处理。
+
+磁盘按保存路径的 st_dev 区分，同一个磁盘上的种子从小到大依次校验；
+所有正在校验的种子每隔 poll_interval 秒用一次请求查询进度。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+from client.btclient import BTClient
+from utils.metrics import metrics
+
+# 刚开始校验时客户端可能还没有切换到校验状态，这段时间内不认为校验已经结束
+RECHECK_GRACE = 30.0
+
+
+class RecheckItem:
+    __slots__ = ('info_hash', 'size', 'volume', 'started', 'seen_checking')
+
+    def __init__(self, info_hash: str, size: int, volume: int):
+        self.info_hash = info_hash
+        self.size = size
+        self.volume = volume
+        self.started = 0.0
+        self.seen_checking = False
+
+
+class RecheckScheduler:
+    def __init__(self, client: BTClient, concurrency: int = 2, max_bytes: int = 0, poll_interval: float = 10.0,
+                 call: Optional[Callable] = None):
+        """
+        Args:
+            client: 客户端
+            concurrency: 每个磁盘同时校验的种子数
+            max_bytes: 每个磁盘同时校验的种子总体积，0 表示不限制；单个种子超过时也会校验，只是不和其他种子同时进行
+            poll_interval: 查询进度的间隔(秒)
+            call: 调用客户端方法的函数，用来和其他调用共享并发限制，默认直接调用
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.call = call or (lambda func, *args: func(*args))
+        self.pending = {}  # type: dict[int, list[tuple[int, int, RecheckItem]]]
+        self.checking = {}  # type: dict[str, RecheckItem]
+        self.volume_count = {}  # type: dict[int, int]
+        self.volume_bytes = {}  # type: dict[int, int]
+        self.volumes = {}  # type: dict[str, int]
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def volume_of(self, save_path: str) -> int:
+        if (volume := self.volumes.get(save_path)) is None:
+            try:
+                volume = (await asyncio.to_thread(os.stat, save_path)).st_dev
+            except OSError:
+                volume = -1
+            self.volumes[save_path] = volume
+        return volume
+
+    async def submit(self, info_hash: str, save_path: str, size: int):
+        """
+        加入等待校验的队列，种子需要已经添加到客户端并且完成了重命名
+        """
+        volume = await self.volume_of(save_path)
+        item = RecheckItem(info_hash, size, volume)
+        heapq.heappush(self.pending.setdefault(volume, []), (size, next(self.counter), item))
+        self.idle.clear()
+        self.wakeup.set()
+
+    def can_start(self, volume: int, size: int) -> bool:
+        count = self.volume_count.get(volume, 0)
+        if not count:
+            return True
+        return count < self.concurrency and (not self.max_bytes or self.volume_bytes[volume] + size <= self.max_bytes)
+
+    async def start_pending(self):
+        items = []
+        for volume, heap in self.pending.items():
+            while heap and self.can_start(volume, heap[0][0]):
+                item = heapq.heappop(heap)[2]
+                self.volume_count[volume] = self.volume_count.get(volume, 0) + 1
+                self.volume_bytes[volume] = self.volume_bytes.get(volume, 0) + item.size
+                items.append(item)
+        if not items:
+            return
+        try:
+            await self.call(self.client.recheck, [item.info_hash for item in items])
+        except Exception as e:
+            logger.error(f'Cannot recheck {len(items)} torrents: {e}')
+            for item in items:
+                self.finish(item)
+            return
+        now = time.monotonic()
+        for item in items:
+            item.started = now
+            self.checking[item.info_hash] = item
+        metrics.inc('recheck_started', len(items))
+        logger.info(f'开始校验 {len(items)} 个种子，正在校验 {len(self.checking)} 个，'
+                    f'等待校验 {sum(map(len, self.pending.values()))} 个')
+
+    def finish(self, item: RecheckItem):
+        self.checking.pop(item.info_hash, None)
+        self.volume_count[item.volume] -= 1
+        self.volume_bytes[item.volume] -= item.size
+
+    async def poll(self):
+        try:
+            statuses = await self.call(self.client.get_progress, list(self.checking))
+        except Exception as e:
+            logger.error(f'Cannot get progress of torrents: {e}')
+            return
+        now = time.monotonic()
+        completed = []
+        for item in list(self.checking.values()):
+            if (status := statuses.get(item.info_hash)) is None:
+                logger.warning(f'Torrent {item.info_hash} is no longer in client')
+                self.finish(item)
+                continue
+            if status.checking:
+                item.seen_checking = True
+                continue
+            if not item.seen_checking and now - item.started < RECHECK_GRACE:
+                continue
+            self.finish(item)
+            if status.progress >= 1:
+                completed.append(item.info_hash)
+            else:
+                metrics.inc('recheck_incomplete')
+                logger.warning(f'Torrent {item.info_hash} is {status.progress:.2%} complete after recheck, left paused')
+        if completed:
+            try:
+                await self.call(self.client.resume, completed)
+                metrics.inc('recheck_resumed', len(completed))
+                logger.info(f'{len(completed)} 个种子校验完成，已开始做种')
+            except Exception as e:
+                logger.error(f'Cannot resume {len(completed)} torrents: {e}')
+
+    async def run(self):
+        """
+        一直运行，直到被取消
+        """
+        while True:
+            await self.start_pending()
+            if self.checking:
+                await asyncio.sleep(self.poll_interval)
+                await self.poll()
+            elif not any(self.pending.values()):
+                self.idle.set()
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+    async def join(self):
+        """
+        等待所有种子校验完成
+        """
+        await self.idle.wait()
@@ -42,3 +42,63 @@ max_missing_size = 1024 ** 3  # type: int
 '检测种子缺失部分的最大值，超过这个值不辅种'
 torrents_folder = '/de/to'  # type: str
 '存放 .torrent 文件的目录,如果这个值为空，则所有辅种的种子从网站下载，否则的话先搜索目录里是否有对应种子然后下载，.torrent 文件可以随意命名'
+update_workers = 5  # type: int
+'更新数据时同时下载种子的初始数量，之后根据网站的响应在 1 和 fetch_max_concurrency 之间自动调整'
+update_checkpoint_interval = 100  # type: int
+'更新数据时每写入多少个种子保存一次进度，中断后再次更新会从断点继续'
+fetch_rate = 2.0  # type: float
+'访问 U2 的初始速率(请求/秒)，之后根据网站的响应在 fetch_min_rate 和 fetch_max_rate 之间自动调整'
+fetch_min_rate = 0.2  # type: float
+'访问 U2 的最低速率(请求/秒)'
+fetch_max_rate = 10.0  # type: float
+'访问 U2 的最高速率(请求/秒)'
+fetch_max_concurrency = 32  # type: int
+'访问 U2 时同时进行的请求数的上限'
+fetch_timeout = 30.0  # type: float
+'访问 U2 的单个请求超时时间(秒)'
+fetch_retries = 4  # type: int
+'访问 U2 失败(超时、429、5xx、返回错误页面)后的最大重试次数'
+torrent_cache_folder = 'resources/torrent_cache'  # type: str
+'下载的 .torrent 文件的缓存目录，更新数据和辅种共用，为空则不缓存'
+torrent_cache_size = 1024 ** 3  # type: int
+'.torrent 缓存的总大小上限，超过时删除最久没有用到的文件'
+torrents_folder_workers = 0  # type: int
+'读取 torrents_folder 中新增 .torrent 文件的进程数，0 表示使用 CPU 核数'
+io_threads = 8  # type: int
+'执行文件扫描、读取 .torrent 文件以及客户端调用的线程数'
+entry_workers = 4  # type: int
+'同时处理的 src_path 下的条目数'
+client_concurrency = 2  # type: int
+'同时进行的客户端调用数，对于 deluge 同时也是 RPC 连接池的大小'
+file_index_min_size = 100 * 1024 ** 2  # type: int
+'更新数据时把种子中不小于这个体积的文件都加入反向索引，缺少最大文件的文件夹或者零散的文件也能通过其他文件找到种子，0 表示不使用'
+watch_settle_time = 10.0  # type: float
+'watch 模式下，条目在这么多秒内没有变化并且文件数、总体积不变，才认为下载或复制完成，开始辅种'
+watch_poll_interval = 30.0  # type: float
+'watch 模式下不能使用 inotify(未安装 inotify_simple 或者超过系统的监视数量限制)时，轮询 src_path 的间隔(秒)'
+watch_refresh_interval = 600.0  # type: float
+'watch 模式下，每隔这么多秒同步一次客户端中的种子并重新读取 torrents_folder'
+verify_pieces = 'sample'  # type: str
+'添加种子前用种子中的 piece hash 校验本地文件：sample 只校验每个大文件完整包含的第一个和最后一个 piece，full 校验所有本地有对应文件的 piece(读取全部数据)，为空不校验'
+verify_min_ratio = 0.9  # type: float
+'校验通过的 piece 占校验的 piece 的比例低于这个值时不添加种子，full 模式下这个比例就是匹配的可信度'
+recheck_after_add = False  # type: bool
+'添加并重命名之后让客户端按磁盘依次校验，校验完整的种子自动开始做种，不完整的保持暂停'
+recheck_concurrency = 1  # type: int
+'每个磁盘(按保存路径所在的设备区分)同时校验的种子数'
+recheck_max_bytes = 0  # type: int
+'每个磁盘同时校验的种子总体积上限，0 表示不限制'
+recheck_poll_interval = 10.0  # type: float
+'查询校验进度的间隔(秒)'
+link_mode = ''  # type: str
+'多文件种子中的文件名和本地不同时：为空则添加到本地文件所在的位置，再在客户端中重命名；hardlink/reflink 则在 link_folder 中按种子的目录结构创建硬链接/reflink，添加到那里，不需要重命名。跨文件系统等无法创建链接时仍然使用重命名'
+link_folder = ''  # type: str
+'link_mode 创建链接的目录，需要和 src_path 在同一个文件系统，为空时使用和 src_path 同级的 <src_path>_links 文件夹'
+index_source = ''  # type: str
+'其他节点导出索引的地址(http:// 或 https:// 开头的 URL，或者共享目录)，设置后更新数据前先从这里导入，之后只需要访问网站获取更新的种子'
+index_export_folder = ''  # type: str
+'更新数据后把新增的种子导出到这个目录，供其他节点导入，可以作为共享目录或者用任意静态 HTTP 服务器提供'
+metrics_port = 0  # type: int
+'watch 模式下在这个端口提供 Prometheus 格式的计数和耗时统计，0 表示不开启'
+targets = []  # type: list[dict]
+'多个需要辅种的文件夹和客户端，例如 [{"src_path": "/vol1/dl", "client_type": "qb"}, {"src_path": "/vol2/dl", "client_type": "de", "port": 58846}]，每项可以写 src_path、client_type、host、port、username、password，没有写的使用上面的同名配置。为空时只辅种 src_path 到 client_type'
@@ -1,81 +1,220 @@
+import argparse
 import asyncio
+import errno
 import os
-import sys
-from hashlib import sha1
-from time import sleep
-from typing import Optional
-
-import aiohttp
-import qbittorrentapi
-from deluge_client import LocalDelugeRPCClient
-from loguru import logger
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional
 
-from config import src_path, duplicate_sizes, host, port, username, password, char_map, max_missing_size, torrents_folder, client_type
-from utils.bencoder import bdecode, bencode
-from web.update import update
-from client import Deluge, Qbittorrent
+from loguru import logger
 
-logger.add(level='DEBUG', sink=f'{os.getcwd()}/logs/main-{{time}}.log')
+from config import (src_path, host, port, username, password, char_map, max_missing_size, torrents_folder,
+                    client_type, torrents_folder_workers, io_threads, entry_workers, client_concurrency,
+                    watch_settle_time, watch_poll_interval, watch_refresh_interval, metrics_port, targets,
+                    verify_pieces, verify_min_ratio, recheck_after_add, recheck_concurrency, recheck_max_bytes,
+                    recheck_poll_interval, link_mode, link_folder, index_source, index_export_folder)
+from utils.backfill import backfill
+from utils.bencoder import BdecodeError
+from utils.filematch import FileMatch, match_files
+from utils.fingerprint import rank_candidates
+from utils.folderindex import TorrentFolderIndex
+from utils.linktree import build_tree, plan_links
+from utils.fsscan import FolderSnapshot, index_keys, scan
+from utils.metrics import log_summary, metrics
+from utils.torrent import Torrent
+from utils.verify import local_files_for_single, verify
+from utils.watcher import EntryWatcher
+from web.indexshare import export_index, import_index
+from web.update import Update, get_update
+from client.btclient import BTClient
+from client.plan import PlanEntry, PlanRecorder, load_done, load_plan, mark_done, mark_progress, save_plan
+from client.recheck import RecheckScheduler
+
+CLIENT_TYPES = ('QB', 'qb', 'qbittorrent', 'DE', 'de', 'deluge')
+
+
+class Target(NamedTuple):
+    """
+    一个需要辅种的文件夹以及添加到的客户端
+    """
+    src_path: str
+    client_type: str
+    host: str
+    port: int
+    username: str
+    password: str
+
+    @property
+    def client_key(self) -> tuple[str, str, int]:
+        return 'qb' if self.client_type in ('QB', 'qb', 'qbittorrent') else 'de', self.host, self.port
+
+
+def load_targets(src: Optional[str] = None, client_name: Optional[str] = None) -> list[Target]:
+    """
+    命令行指定了 --src 或 --client，或者 config.targets 为空时，只有 src_path 和 client_type 组成的一个目标，
+    否则使用 config.targets，其中没有写的项使用 config 中的同名配置
+    """
+    default = {'src_path': src or src_path, 'client_type': client_name or client_type,
+               'host': host, 'port': port, 'username': username, 'password': password}
+    if src or client_name or not targets:
+        return [Target(**default)]
+    return [Target(**{**default, **target}) for target in targets]
+
+
+def make_client(target: Target) -> BTClient:
+    if target.client_type in ('QB', 'qb', 'qbittorrent'):
+        from client.qb import Qbittorrent
+        return Qbittorrent(host=target.host, port=target.port, username=target.username, password=target.password)
+    elif target.client_type in ('DE', 'de', 'deluge'):
+        from client.deluge import Deluge
+        return Deluge(host=target.host, port=target.port, username=target.username, password=target.password,
+                      connections=client_concurrency)
+    raise ValueError(f'Unknown client type {target.client_type}')
+
+
+def open_folder_index() -> Optional[TorrentFolderIndex]:
+    if not torrents_folder:
+        return None
+    logger.info(f'开始读取 {torrents_folder} 中的 .torrent 文件...')
+    folder_index = TorrentFolderIndex(torrents_folder, workers=torrents_folder_workers)
+    count = folder_index.refresh()
+    logger.info(f'所有 .torrent 文件读取完毕，共 {len(folder_index.hash_to_fn)} 个种子，本次读取了 {count} 个新增或修改的文件')
+    return folder_index
 
 
 class U2AuxSeed:
-    def __init__(self):
-        self.size_id = update.size_id
-        logger.info('欢迎使用 u2_aux_seed 脚本')
-        logger.info(
-            f'当前可辅种的最新的种子 id 为 {update.newest_tid}, 是否需要更新数据？更新需要一定时间，更新后可辅种最新的种子')
-        logger.info(f'输入 y/n')
-        if input().lower() == 'y':
-            asyncio.run(update.main())
-        if client_type in ('QB', 'qb', 'qbittorrent'):
-            self.client = Qbittorrent(qbittorrentapi.Client(host=host, port=port, username=username, password=password))
-        elif client_type in ('DE', 'de', 'deluge'):
-            self.client = Deluge(LocalDelugeRPCClient(host=host, port=port, username=username, password=password))
-        self.hashes_in_client = self.client.get_hashes()
+    """
+    把若干个文件夹辅种到同一个客户端。每个文件夹有自己的队列和 entry_workers 个 worker，
+    客户端中的种子 hash 和认领状态在这些文件夹之间共享，索引、缓存和网络会话在所有客户端之间共享
+    """
+
+    def __init__(self, src_paths: list[str], client: BTClient, folder_index: Optional[TorrentFolderIndex] = None):
+        """
+        Args:
+            src_paths: 需要辅种的文件所在的文件夹
+            client: 添加种子的客户端
+            folder_index: torrents_folder 的索引，多个客户端共用一个
+        """
+        self.update = get_update()
+        self.size_index = self.update.size_index
+        self.src_paths = src_paths
+        self.client = client
+        self.hashes_in_client = set()
+        self.claimed_hashes = set()
+        self.executor = None  # type: Optional[ThreadPoolExecutor]
+        self.client_sem = None  # type: Optional[asyncio.Semaphore]
         self.hash_to_fn = {}
-        if torrents_folder:
-            logger.info(f'开始读取 {torrents_folder} 中的 .torrent 文件...')
-            for fn in os.listdir(torrents_folder):
-                if fn.endswith('.torrent'):
-                    try:
-                        info_hash = sha1(bencode(bdecode(os.path.join(torrents_folder, fn))[b'info'])).hexdigest()
-                        self.hash_to_fn[info_hash] = fn
-                    except:
-                        pass
-            logger.info(f'所有 .torrent 文件读取完毕')
-
-    @staticmethod
-    def get_max_size_in_path(path: str) -> int:
-        max_size = 0
-        for root, dirs, files in os.walk(path):
-            if files:
-                for file in files:
-                    size = os.path.getsize(os.path.join(root, file))
-                    if size > max_size:
-                        max_size = size
-
-        if max_size in duplicate_sizes:
-            _max_size = max_size
-            max_size = 0
-            for root, dirs, files in os.walk(path):
-                if files:
-                    for file in files:
-                        size = os.path.getsize(os.path.join(root, file))
-                        if size > max_size and size != _max_size:
-                            max_size = size
-            if max_size == 0:
-                max_size = _max_size
-
-        return max_size
-
-    @staticmethod
-    def get_file_list_in_folder(path: str) -> list[str]:
-        file_list = []
-        for root, dirs, files in os.walk(path):
-            if files:
-                for file in files:
-                    file_list.append(os.path.join(root, file))
-        return file_list
+        self.tids = {}  # type: dict[str, int]
+        self.folder_index = folder_index
+        if folder_index:
+            self.hash_to_fn = folder_index.hash_to_fn
+        self.rechecker = None  # type: Optional[RecheckScheduler]
+        # 不能在 link_folder 中创建链接的文件夹
+        self.unlinkable = set()  # type: set[str]
+
+    def get_candidates(self, sizes: Iterable[int]) -> list[tuple[int, str]]:
+        """
+        返回可能与体积为 sizes 的这些文件匹配的种子 (种子 id, info hash)，
+        torrents_folder 中有但是体积索引里没有的种子也会返回，种子 id 为 0，这些种子只从本地读取。
+        有指纹的种子先在本地和这些文件比较，缺失体积超过 max_missing_size 的不返回，其余按缺失体积排序。
+        都不匹配时再用文件体积反向索引投票
+        """
+        local_sizes = Counter(sizes)
+        candidates = []
+        known = set()
+        metrics.inc('index_lookups')
+        for key in index_keys(sorted(local_sizes.elements(), reverse=True)):
+            for tid, _hash in self.size_index.get(key):
+                if _hash not in known:
+                    known.add(_hash)
+                    candidates.append((tid, _hash))
+            if self.folder_index:
+                for _hash in self.folder_index.get(key):
+                    if _hash not in known:
+                        known.add(_hash)
+                        candidates.append((0, _hash))
+        if candidates:
+            metrics.inc('index_hits')
+            metrics.inc('index_candidates', len(candidates))
+        if ranked := rank_candidates(candidates, self.update.fingerprints, local_sizes, max_missing_size):
+            metrics.inc('index_rejected_by_fingerprint', len(candidates) - len(ranked))
+            return ranked
+        metrics.inc('index_rejected_by_fingerprint', len(candidates))
+        if self.update.file_index is not None:
+            # 按最大体积找不到时，用所有文件的体积投票，找缺少最大文件或者只有部分文件的种子
+            with metrics.time('file_index_vote'):
+                votes = self.update.file_index.vote(local_sizes.elements(), max_missing_size)
+            metrics.inc('file_index_votes', len(votes))
+            for vote in votes:
+                logger.debug(f'Torrent {vote.tid} matched {vote.matched} bytes by file sizes, {vote.missing} bytes missing')
+            return [(vote.tid, vote.info_hash) for vote in votes]
+        return []
+
+    async def run_in_thread(self, func: Callable, *args, **kwargs):
+        """
+        在线程池中执行阻塞的文件系统操作
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def call_client(self, func: Callable, *args, **kwargs):
+        """
+        调用客户端的异步方法，同时进行的调用数量不超过 client_concurrency
+        """
+        async with self.client_sem:
+            with metrics.time('client_rpc', method=func.__name__):
+                return await func(*args, **kwargs)
+
+    def start_rechecker(self) -> Optional[asyncio.Task]:
+        """
+        开启 recheck_after_add 时创建校验调度并在后台运行，plan 模式下或者客户端不支持时不校验
+        """
+        if not recheck_after_add or isinstance(self.client, PlanRecorder):
+            return None
+        if not self.client.supports_recheck:
+            logger.warning(f'{type(self.client).__name__} 不支持校验，添加后不会自动校验和开始种子')
+            return None
+        self.rechecker = RecheckScheduler(self.client, recheck_concurrency, recheck_max_bytes, recheck_poll_interval,
+                                          self.call_client)
+        return asyncio.create_task(self.rechecker.run())
+
+    async def schedule_recheck(self, torrent: Torrent, save_path: str):
+        """
+        种子添加并重命名之后交给校验调度
+        """
+        if self.rechecker is not None:
+            await self.rechecker.submit(torrent.info_hash, save_path, sum(torrent.file_sizes))
+
+    async def wait_rechecks(self):
+        if self.rechecker is not None and not self.rechecker.idle.is_set():
+            logger.info('等待新添加的种子校验完成...')
+            await self.rechecker.join()
+
+    def claim(self, _hash: str) -> bool:
+        """
+        多个条目可能匹配到同一个种子，只有第一个认领成功的去添加，用完需要 release
+        """
+        if _hash in self.hashes_in_client or _hash in self.claimed_hashes:
+            return False
+        self.claimed_hashes.add(_hash)
+        return True
+
+    def release(self, _hash: str):
+        self.claimed_hashes.discard(_hash)
+
+    async def verify_local_files(self, torrent: Torrent, tid: int, local_files: list[Optional[str]]) -> bool:
+        """
+        按 verify_pieces 用 piece hash 校验种子对应的本地文件，通过的比例低于 verify_min_ratio 时返回 False
+        """
+        if not verify_pieces:
+            return True
+        result = await verify(torrent.info, local_files, verify_pieces == 'full', self.executor)
+        if result.ratio < verify_min_ratio:
+            logger.error(f'Cannot add torrent {tid}, because only {result.passed}/{result.checked} pieces passed verification')
+            return False
+        if result.checked:
+            logger.info(f'Torrent {tid} verified, {result.passed}/{result.checked} pieces passed ({result.ratio:.1%})')
+        return True
 
     @staticmethod
     def decode_name(name: bytes) -> Optional[str]:
@@ -90,256 +229,643 @@ class U2AuxSeed:
                 pass
         return ''
 
-    def add_torrent_to_single_file(self, path: str, content: bytes, tid: str, info_hash: str):
-        try:
-            info_dict = bdecode(content)[b'info']
-        except:
-            return
+    async def add_torrent_to_single_file(self, snapshot: FolderSnapshot, torrent: Torrent, tid: int):
+        path = snapshot.root
+        info_dict = torrent.info
+        _hash = torrent.info_hash
         save_path, filename = os.path.split(path)
 
+        if not await self.verify_local_files(torrent, tid, local_files_for_single(info_dict, path, snapshot.sizes[path])):
+            return
         if b'files' not in info_dict:
             name = self.decode_name(info_dict[b'name'])
             if name:
-                self.client.add_torrent(content, save_path, True)
-                self.hashes_in_client.add(info_hash)
+                await self.call_client(self.client.add_torrent, torrent, save_path, True)
+                self.hashes_in_client.add(_hash)
                 if name != filename:
-                    self.client.rename_file(info_hash, name, filename)
-                logger.info(f'Add torrent {tid}, info_hash {info_hash}')
+                    await self.call_client(self.client.rename_file, _hash, name, filename)
+                logger.info(f'Add torrent {tid}, info_hash {_hash}')
+                await self.schedule_recheck(torrent, save_path)
             else:
                 logger.error(f'Cannot add torrent {tid}, because file name cannot be decoded')
         else:
-            size1 = os.path.getsize(path)
+            size1 = snapshot.sizes[path]
             size2 = 0
             old_name = ''
             for i, file in enumerate(info_dict[b'files']):
                 if (length := file[b'length']) != size1:
                     size2 += length
                 else:
-                    old_name = os.path.join(self.decode_name(file[b'name']), *map(self.decode_name, file[b'path']))
+                    old_name = os.path.join(self.decode_name(info_dict[b'name']), *map(self.decode_name, file[b'path']))
             if size2 <= max_missing_size:
-                self.client.add_torrent(content, save_path, True)
-                self.hashes_in_client.add(info_hash)
-                self.client.rename_file(info_hash, old_name, filename)
+                await self.call_client(self.client.add_torrent, torrent, save_path, True)
+                self.hashes_in_client.add(_hash)
+                await self.call_client(self.client.rename_file, _hash, old_name, filename)
+                logger.info(f'Add torrent {tid}, info_hash {_hash}')
+                await self.schedule_recheck(torrent, save_path)
             else:
                 logger.error(f'Cannot add torrent {tid}, because missing file size exceeded')
 
-    async def get_torrent_content(self, tid, _hash):
+    @staticmethod
+    def read_torrent_file(path: str) -> Torrent:
+        with open(path, 'rb') as fp:
+            return Torrent(fp.read())
+
+    def remember_torrent(self, tid: int, torrent: Torrent):
+        """
+        读到的种子顺便补上指纹和文件体积索引，以前的种子不需要 backfill 也会逐渐有这两个索引
+        """
+        self.update.fingerprints.add(torrent.info_hash, torrent.fingerprint)
+        if tid and self.update.file_index is not None:
+            self.update.file_index.add(tid, torrent.info_hash, torrent.file_sizes)
+
+    async def get_torrent(self, tid: int, _hash: str) -> Optional[Torrent]:
+        """
+        依次从 torrents_folder、本地缓存中读取种子，都没有时才从网站下载
+        """
+        torrent = await self.read_torrent(tid, _hash)
+        if torrent:
+            self.remember_torrent(tid, torrent)
+        return torrent
+
+    async def read_torrent(self, tid: int, _hash: str) -> Optional[Torrent]:
+        self.tids[_hash] = tid
         if fn := self.hash_to_fn.get(_hash):
-            with open(os.path.join(torrents_folder, fn), 'rb') as fp:
-                content = fp.read()
-            logger.info(f'Read .torrent file {fn}')
-        else:
-            content = await update.fetch_torrent(tid)
-            logger.info(f'Downloaded .torrent file of torrent {tid}')
-        return content
-
-    async def aux_seed_single_file(self, path: str):
-        max_size = os.path.getsize(path)
-        if tid_hash := self.size_id.get(str(max_size)):
-            if isinstance(tid_hash, str):
-                tid_hash = [tid_hash]
-                for _tid_hash in tid_hash:
-                    tid, _hash = _tid_hash.split('_')
-                    if _hash not in self.hashes_in_client:
+            try:
+                torrent = await self.run_in_thread(self.read_torrent_file, os.path.join(torrents_folder, fn))
+                logger.info(f'Read .torrent file {fn}')
+                metrics.inc('torrent_reads', source='torrents_folder')
+                return torrent
+            except (OSError, BdecodeError):
+                logger.error(f'Cannot read .torrent file {fn}')
+                # 所有客户端共用索引，之后不再读这个文件；文件修改后刷新索引时才会重新读取
+                self.hash_to_fn.pop(_hash, None)
+                if self.folder_index:
+                    await self.run_in_thread(self.folder_index.forget, fn)
+        if torrent := await self.run_in_thread(self.update.get_cached_torrent, _hash):
+            logger.info(f'Read cached .torrent file of torrent {tid}')
+            metrics.inc('torrent_reads', source='cache')
+            return torrent
+        if tid:
+            with metrics.time('torrent_download'):
+                torrent = await self.update.fetch_torrent(tid)
+            if torrent:
+                logger.info(f'Downloaded .torrent file of torrent {tid}')
+            metrics.inc('torrent_reads', source='download' if torrent else 'download_failed')
+            return torrent
+
+    async def aux_seed_single_file(self, snapshot: FolderSnapshot):
+        path = snapshot.root
+        if tid_hash := self.get_candidates(snapshot.sorted_sizes):
+            for tid, _hash in tid_hash:
+                if self.claim(_hash):
+                    try:
                         logger.info(f'{path} -> torrent {tid}')
-                        content = await self.get_torrent_content(tid, _hash)
-                        self.add_torrent_to_single_file(path, content, tid, _hash)
-                    else:
-                        logger.debug(f'{path} -> torrent {tid} already added')
+                        if torrent := await self.get_torrent(tid, _hash):
+                            await self.add_torrent_to_single_file(snapshot, torrent, tid)
+                    finally:
+                        self.release(_hash)
+                else:
+                    logger.debug(f'{path} -> torrent {tid} already added')
         else:
             logger.debug(f'{path} cannot be auxseeded')
 
-    def add_torrent_to_multi_file(self, path: str, file_list: list[str], content: bytes, tid: str, _hash: str):
-        try:
-            info_dict = bdecode(content)[b'info']
-        except:
-            return
+    async def add_torrent_to_multi_file(self, snapshot: FolderSnapshot, file_list: list[str], torrent: Torrent, tid: int):
+        path = snapshot.root
+        info_dict = torrent.info
+        _hash = torrent.info_hash
         if b'files' not in info_dict:
             size1 = info_dict[b'length']
             size2 = 0
             name = ''
             save_path = ''
-            for file in list(file_list):
-                if (size := os.path.getsize(file)) == size1:
+            same_size = []
+            for file in file_list:
+                if (size := snapshot.sizes[file]) == size1:
                     save_path, name = os.path.split(file)
-                    file_list.remove(file)
+                    same_size.append(file)
                 else:
                     size2 += size
             if size2 > max_missing_size:
                 logger.error(f'Cannot add torrent {tid}, because missing file size exceeded')
+            elif same_size and not await self.verify_local_files(torrent, tid, same_size[-1:]):
+                return
             else:
-                self.client.add_torrent(content, save_path, True)
+                for file in same_size:
+                    file_list.remove(file)
+                await self.call_client(self.client.add_torrent, torrent, save_path, True)
                 self.hashes_in_client.add(_hash)
                 logger.info(f'Add torrent {tid} -> {path}')
                 if (origin_name := self.decode_name(info_dict[b'name'])) != name:
-                    self.client.rename_file(_hash, origin_name, name)
+                    await self.call_client(self.client.rename_file, _hash, origin_name, name)
                     logger.info(f'Rename file of torrent {tid}, {origin_name} -> {name}')
+                await self.schedule_recheck(torrent, save_path)
         else:
-            folder_name_map = self.map_torrent_files_to_multi_file(path, self.decode_name(info_dict[b'name']),
-                                                                   file_list, info_dict[b'files'])
+            match = await self.run_in_thread(
+                self.map_torrent_files_to_multi_file, path, self.decode_name(info_dict[b'name']),
+                file_list, info_dict[b'files'], snapshot.sizes
+            )
+            if match is None:
+                logger.error(f'Cannot add torrent {tid}, because missing file size exceeded')
+                return
+            if not await self.verify_local_files(torrent, tid, match.local_files):
+                return
+            file_list[:] = [file for file in file_list if file not in match.matched]
             base_path = os.path.split(path)[0]
-            self.client.add_torrent(content, base_path, True)
+            if match.renames and (link_root := await self.link_torrent(torrent, tid, base_path, match)):
+                await self.call_client(self.client.add_torrent, torrent, link_root, True)
+                self.hashes_in_client.add(_hash)
+                logger.info(f'Add torrent {tid} -> {link_root}')
+                await self.schedule_recheck(torrent, link_root)
+                return
+            await self.call_client(self.client.add_torrent, torrent, base_path, True)
             self.hashes_in_client.add(_hash)
-            sleep(0.1)
+            await asyncio.sleep(0.1)
             logger.info(f'Add torrent {tid} -> {path}')
-            for torrent_folder, local_folder in folder_name_map.items():
-                torrent_folder_path = os.path.join(base_path, torrent_folder)
-                if os.path.exists(torrent_folder_path):
-                    logger.error(f'Folder {torrent_folder_path} existed')
-                    continue
-                local_folder_path = os.path.join(base_path, local_folder)
-                if os.path.exists(local_folder_path) and not os.path.isdir(local_folder_path):
-                    try:
-                        self.client.rename_file(_hash, torrent_folder, local_folder)
-                        logger.info(f'Rename file of torrent {tid}, {torrent_folder} -> {local_folder}')
-                    except Exception as e:
-                        logger.error(e)
-                else:
-                    try:
-                        self.client.rename_folder(_hash, torrent_folder, local_folder)
-                        logger.info(f'Rename folder of torrent {tid}, {torrent_folder} -> {local_folder}')
-                    except Exception as e:
-                        logger.error(e)
+            await self.rename_torrent_folders(_hash, tid, base_path, match.renames)
+            await self.schedule_recheck(torrent, base_path)
+
+    async def link_torrent(self, torrent: Torrent, tid: int, base_path: str, match: FileMatch) -> Optional[str]:
+        """
+        按 link_mode 在 link_folder 中创建种子的目录结构，返回种子的保存路径；
+        没有开启、plan 模式(不能修改文件)或者无法创建链接时返回 None，改用重命名
+        """
+        if not link_mode or isinstance(self.client, PlanRecorder):
+            return None
+        link_root = link_folder or f'{base_path.rstrip(os.sep)}_links'
+        if base_path in self.unlinkable:
+            return None
+        try:
+            links = plan_links(link_root, torrent.info, match.local_files, self.decode_name)
+        except ValueError as e:
+            logger.error(f'Cannot create {link_mode} of torrent {tid}, rename files instead: {e}')
+            return None
+        try:
+            with metrics.time('link_tree', mode=link_mode):
+                await build_tree(links, link_mode, self.executor)
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.EOPNOTSUPP):
+                # 不在同一个文件系统或者文件系统不支持 reflink，之后这个文件夹里的种子都不再尝试
+                logger.warning(f'Cannot create {link_mode} from {base_path} in {link_root}, rename files instead: {e}')
+                self.unlinkable.add(base_path)
+            else:
+                logger.error(f'Cannot create {link_mode} of torrent {tid} in {link_root}, rename files instead: {e}')
+            return None
+        metrics.inc('links', len(links), mode=link_mode)
+        logger.info(f'Created {len(links)} {link_mode}s of torrent {tid} in {link_root}')
+        return link_root
 
-    def map_torrent_files_to_multi_file(self, path: str, name: str, file_list: list[str],
-                                        torrent_files: list[dict[bytes, int | list[bytes]]]) -> dict[str, str]:
-        folder_name_map = {}
-        base_path, folder_name = os.path.split(path)
-
-        local_files_size_to_path = {os.path.getsize(path): path for path in file_list}
-        torrent_files.sort(key=lambda x: x[b'length'], reverse=True)
-
-        unmatch_size = 0
-        for torrent_file in torrent_files:
-            if (size := torrent_file[b'length']) not in local_files_size_to_path:
-                unmatch_size += size
-                if unmatch_size > max_missing_size:
-                    return {}
-
-        for torrent_file in torrent_files:
-            if (size := torrent_file[b'length']) in local_files_size_to_path:
-                if size > 4 * 1024 ** 2:
-
-                    missing_size = 0
-                    for _torrent_file in torrent_files:
-                        _torrent_file_path = os.path.join(base_path, name, *list(map(self.decode_name, _torrent_file[b'path'])))
-                        for key, val in folder_name_map.items():
-                            _torrent_file_path = _torrent_file_path.replace(key, val)
-                        if _torrent_file_path not in file_list:
-                            missing_size += _torrent_file[b'length']
-                    if missing_size == unmatch_size:
-                        self.remove_files_from_file_list(base_path, name, file_list, torrent_files, folder_name_map)
-                        return folder_name_map
-
-                    local_file_path = local_files_size_to_path[size][len(base_path) + 1:]
-                    torrent_file_path = os.path.join(name, *list(map(self.decode_name, torrent_file[b'path'])))
-
-                    for key, val in folder_name_map.items():
-                        torrent_file_path = torrent_file_path.replace(key, val)
-
-                    if local_file_path == torrent_file_path:
-                        continue
-                    else:
-                        flag = False
-                        for _torrent_file in torrent_files:
-                            _torrent_file_path = os.path.join(name, *list(map(self.decode_name, _torrent_file[b'path'])))
-                            if _torrent_file_path == local_file_path and _torrent_file[b'length'] == size:
-                                flag = True
-                        if flag:
-                            continue
+    @staticmethod
+    def classify_renames(base_path: str, folder_name_map: dict[str, str]) -> list[tuple[bool, str, str]]:
+        """
+        返回需要执行的重命名 (是否为文件, 种子中的名字, 本地的名字)，种子中的名字在本地已经存在的跳过
+        """
+        renames = []
+        for torrent_folder, local_folder in folder_name_map.items():
+            torrent_folder_path = os.path.join(base_path, torrent_folder)
+            if os.path.exists(torrent_folder_path):
+                logger.error(f'Folder {torrent_folder_path} existed')
+                continue
+            local_folder_path = os.path.join(base_path, local_folder)
+            is_file = os.path.exists(local_folder_path) and not os.path.isdir(local_folder_path)
+            renames.append((is_file, torrent_folder, local_folder))
+        return renames
+
+    async def rename_torrent_folders(self, _hash: str, tid: int, base_path: str, folder_name_map: dict[str, str]):
+        """
+        按照 map_torrent_files_to_multi_file 的结果把种子里的文件夹或文件重命名为本地的名字，
+        连续的文件重命名合并为一次 rename_files 调用
+        """
+        files = []
+
+        async def flush():
+            if files:
+                try:
+                    await self.call_client(self.client.rename_files, _hash, list(files))
+                    for torrent_file, local_file in files:
+                        logger.info(f'Rename file of torrent {tid}, {torrent_file} -> {local_file}')
+                except Exception as e:
+                    logger.error(e)
+                files.clear()
+
+        for is_file, torrent_folder, local_folder in await self.run_in_thread(
+                self.classify_renames, base_path, folder_name_map):
+            if is_file:
+                files.append((torrent_folder, local_folder))
+                continue
+            await flush()
+            try:
+                await self.call_client(self.client.rename_folder, _hash, torrent_folder, local_folder)
+                logger.info(f'Rename folder of torrent {tid}, {torrent_folder} -> {local_folder}')
+            except Exception as e:
+                logger.error(e)
+        await flush()
 
-                    separator = '\\' if sys.platform == 'win32' else '/'
-
-                    local_file_path_list = local_file_path.split(separator)
-                    torrent_file_path_list = torrent_file_path.split(separator)
-
-                    is_file = True
-                    for i in range(min(len(local_file_path_list), len(torrent_file_path_list)) - 1):
-                        if local_file_path_list[-1] == torrent_file_path_list[-1]:
-                            is_file = False
-                            local_file_path_list.pop(-1)
-                            torrent_file_path_list.pop(-1)
-                        else:
-                            break
-
-                    torrent_folder = separator.join(torrent_file_path_list)
-                    local_folder = separator.join(local_file_path_list)
-                    if not is_file:
-                        torrent_folder += separator
-                        local_folder += separator
-
-                    if torrent_folder not in folder_name_map:
-                        folder_name_map[torrent_folder] = local_folder
-
-        self.remove_files_from_file_list(base_path, name, file_list, torrent_files, folder_name_map)
-        return folder_name_map
-
-    def remove_files_from_file_list(self, base_path, name, file_list, torrent_files, folder_name_map):
-        for _torrent_file in torrent_files:
-            _torrent_file_path = os.path.join(base_path, name, *list(map(self.decode_name, _torrent_file[b'path'])))
-            for key, val in folder_name_map.items():
-                _torrent_file_path = _torrent_file_path.replace(key, val)
-            if _torrent_file_path in file_list:
-                file_list.remove(_torrent_file_path)
-
-    async def aux_seed_folder(self, path: str):
-        max_size = self.get_max_size_in_path(path)
-        if not (tid_hash := self.size_id.get(str(max_size))):
+    def map_torrent_files_to_multi_file(self, path: str, name: str, file_list: list[str],
+                                        torrent_files: list[dict[bytes, int | list[bytes]]],
+                                        sizes: Mapping[str, int]) -> Optional[FileMatch]:
+        """
+        返回种子中的文件和 file_list 的对应关系以及需要执行的重命名，缺失的体积超过 max_missing_size 时返回 None
+        """
+        with metrics.time('match_files'):
+            match = match_files(path, name, file_list, sizes, torrent_files, self.decode_name)
+        metrics.inc('match_files_torrent_files', len(torrent_files))
+        if match.missing_size > max_missing_size:
+            return None
+        return match
+
+    async def aux_seed_folder(self, snapshot: FolderSnapshot):
+        path = snapshot.root
+        if not (tid_hash := self.get_candidates(snapshot.sorted_sizes)):
             logger.debug(f'{path} cannot be auxseeded')
             return
 
-        if isinstance(tid_hash, str):
-            tid_hash = [tid_hash]
-        for _tid_hash in tid_hash:
-            file_list = self.get_file_list_in_folder(path)
-            tid, _hash = _tid_hash.split('_')
-            if _hash in self.hashes_in_client:
+        for tid, _hash in tid_hash:
+            file_list = list(snapshot.sizes)
+            if not self.claim(_hash):
                 logger.debug(f'{path} -> torrent {tid} already added')
                 continue
-            content = await self.get_torrent_content(tid, _hash)
-            await self.add_torrent_loop(path, file_list, content, tid, _hash)
+            try:
+                if torrent := await self.get_torrent(tid, _hash):
+                    await self.add_torrent_loop(snapshot, file_list, torrent, tid)
+            finally:
+                self.release(_hash)
 
-    async def add_torrent_loop(self, path: str, file_list: list[str], content: bytes, tid: str, _hash: str):
+    async def add_torrent_loop(self, snapshot: FolderSnapshot, file_list: list[str], torrent: Torrent, tid: int):
         cur_len = len(file_list)
-        while True:
-            pre_len = cur_len
-            self.add_torrent_to_multi_file(path, file_list, content, tid, _hash)
-            if not file_list:
-                return
-            max_size = max(map(os.path.getsize, file_list))
-            tid_hash = self.size_id.get(str(max_size))
-            if not tid_hash:
-                break
-            if isinstance(tid_hash, list):
-                tid_hash = tid_hash[0]
-            tid, _hash = tid_hash.split('_')
-            content = await self.get_torrent_content(tid, _hash)
-            cur_len = len(file_list)
-            if cur_len == pre_len:
-                break
+        claimed = []
+        try:
+            while True:
+                pre_len = cur_len
+                await self.add_torrent_to_multi_file(snapshot, file_list, torrent, tid)
+                if not file_list:
+                    return
+                tid_hash = self.get_candidates(snapshot.sizes[file] for file in file_list)
+                if not tid_hash:
+                    break
+                tid, _hash = tid_hash[0]
+                if not self.claim(_hash):
+                    break
+                claimed.append(_hash)
+                if not (torrent := await self.get_torrent(tid, _hash)):
+                    break
+                cur_len = len(file_list)
+                if cur_len == pre_len:
+                    break
+        finally:
+            for _hash in claimed:
+                self.release(_hash)
 
     async def aux_seed(self, path):
-        if os.path.isdir(path):
+        snapshot = await self.run_in_thread(scan, path)
+        if not snapshot.sizes:
+            logger.debug(f'{path} has no files')
+            return
+        if snapshot.is_dir:
             try:
-                await self.aux_seed_folder(path)
+                await self.aux_seed_folder(snapshot)
             except Exception as e:
                 logger.exception(e)
         else:
             try:
-                await self.aux_seed_single_file(path)
+                await self.aux_seed_single_file(snapshot)
             except Exception as e:
                 logger.exception(e)
 
-    async def run(self):
-        tasks = []
-        for name in os.listdir(src_path):
-            path = os.path.join(src_path, name)
-            tasks.append(self.aux_seed(path))
-        async with aiohttp.ClientSession() as self.session:
-            await asyncio.gather(*tasks)
-            if update.session:
-                await update.session.close()
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            path = await queue.get()
+            try:
+                await self.aux_seed(path)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                queue.task_done()
+
+    async def start_workers(self) -> tuple[list[asyncio.Queue], list[asyncio.Task]]:
+        """
+        为每个文件夹创建队列和 entry_workers 个 worker，并放入文件夹下已有的条目
+        """
+        queues = []
+        workers = []
+        for src in self.src_paths:
+            queue = asyncio.Queue()
+            for name in await self.run_in_thread(os.listdir, src):
+                queue.put_nowait(os.path.join(src, name))
+            queues.append(queue)
+            workers.extend(asyncio.create_task(self.worker(queue)) for _ in range(entry_workers))
+        return queues, workers
+
+    async def run(self, plan_path: Optional[str] = None):
+        """
+        entry_workers 个 worker 从队列中取 src_path 下的条目，依次执行 扫描 -> 匹配 -> 获取种子 -> 添加，
+        阻塞的文件系统操作在 io_threads 个线程的线程池中执行。
+        传入 plan_path 时不修改客户端，只把要执行的操作写入计划文件，之后用 apply 执行
+        """
+        if plan_path:
+            self.client = PlanRecorder(self.client)
+        self.client_sem = asyncio.Semaphore(client_concurrency)
+        self.hashes_in_client = await self.client.get_hashes()
+        workers = []
+        with ThreadPoolExecutor(io_threads) as self.executor:
+            rechecker = self.start_rechecker()
+            try:
+                queues, workers = await self.start_workers()
+                await asyncio.gather(*(queue.join() for queue in queues))
+                await self.wait_rechecks()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                if rechecker:
+                    rechecker.cancel()
+                if plan_path:
+                    entries = list(self.client.entries.values())
+                    for entry in entries:
+                        entry.tid = self.tids.get(entry.info_hash, 0)
+                    save_plan(plan_path, entries, src_paths=self.src_paths)
+                    logger.info(f'辅种计划已写入 {plan_path}，共 {len(entries)} 个种子')
+                await self.client.close()
+
+    async def refresh(self):
+        """
+        增量同步客户端中的种子，重新读取 torrents_folder 中新增或修改的 .torrent 文件，
+        重新打开其他进程更新过的索引
+        """
+        # 索引在事件循环中查询，在这里重新打开，不会和查询同时进行
+        try:
+            if self.update.reload():
+                logger.info('重新读取了其他进程更新的索引')
+        except Exception as e:
+            logger.error(f'Cannot reload index: {e}')
+        try:
+            self.hashes_in_client = await self.client.get_hashes()
+        except Exception as e:
+            logger.error(f'Cannot refresh torrents in client: {e}')
+        if self.folder_index:
+            # 各个客户端共用索引，同时刷新时只有一个真正扫描目录
+            try:
+                if count := await self.run_in_thread(self.folder_index.refresh):
+                    logger.info(f'读取了 {torrents_folder} 中 {count} 个新增或修改的 .torrent 文件')
+            except Exception as e:
+                logger.error(f'Cannot refresh index of {torrents_folder}: {e}')
+            self.hash_to_fn = self.folder_index.hash_to_fn
+
+    async def follow(self, watcher: EntryWatcher, queue: asyncio.Queue):
+        async for paths in watcher.changes():
+            for path in paths:
+                logger.info(f'{path} 有变化')
+                queue.put_nowait(path)
+
+    async def refresh_periodically(self):
+        while True:
+            await asyncio.sleep(watch_refresh_interval)
+            await self.refresh()
+
+    async def watch(self):
+        """
+        常驻运行：先处理一遍 src_path 下已有的条目，之后只处理新增或有变化、并且已经稳定下来的条目。
+        索引、客户端中的种子 hash 和缓存一直保留在内存中，每隔 watch_refresh_interval 秒调用一次 refresh，
+        同步客户端并重新打开其他进程更新过的索引
+        """
+        self.client_sem = asyncio.Semaphore(client_concurrency)
+        self.hashes_in_client = await self.client.get_hashes()
+        watchers = [EntryWatcher(src, watch_settle_time, watch_poll_interval) for src in self.src_paths]
+        workers = []
+        with ThreadPoolExecutor(io_threads) as self.executor:
+            rechecker = self.start_rechecker()
+            try:
+                # 先开始监视，处理已有条目期间的变化也不会漏掉
+                for watcher in watchers:
+                    watcher.start()
+                queues, workers = await self.start_workers()
+                await asyncio.gather(*(queue.join() for queue in queues))
+                logger.info(f'{", ".join(self.src_paths)} 中已有的条目处理完毕，开始监视新的条目')
+                await asyncio.gather(self.refresh_periodically(),
+                                     *(self.follow(watcher, queue) for watcher, queue in zip(watchers, queues)))
+            finally:
+                for watcher in watchers:
+                    watcher.close()
+                for worker in workers:
+                    worker.cancel()
+                if rechecker:
+                    rechecker.cancel()
+                await self.client.close()
+
+    async def apply_ops(self, entry: PlanEntry, plan_path: str, start: int = 0) -> bool:
+        """
+        从第 start 个操作开始按顺序执行计划中一个种子的重命名，全部成功返回 True。
+        每完成一个操作记录一次进度，中断后再次执行时不会重复已经完成的重命名
+        """
+        for i, (op, *args) in enumerate(entry.ops[start:], start + 1):
+            if op not in ('rename_file', 'rename_files', 'rename_folder'):
+                logger.error(f'Unknown operation {op} of torrent {entry.tid}')
+                return False
+            if op == 'rename_files':
+                args = [[tuple(rename) for rename in args[0]]]
+            try:
+                await self.call_client(getattr(self.client, op), entry.info_hash, *args)
+                logger.info(f'{op} of torrent {entry.tid}, {args}')
+            except Exception as e:
+                logger.error(f'Cannot {op} of torrent {entry.tid}: {e}')
+                return False
+            mark_progress(plan_path, entry.info_hash, i)
+        return True
+
+    async def apply(self, plan_path: str, batch_size: int = 50):
+        """
+        执行 plan 模式生成的计划：读取所有种子，按 (保存路径, 是否暂停) 分批添加，再并发执行各个种子的重命名。
+        完成的种子记录在 <plan_path>.done 中，再次执行时跳过；已经在客户端里的种子不再添加，只执行重命名
+        """
+        entries = load_plan(plan_path)
+        done, progress = load_done(plan_path)
+        pending = [entry for entry in entries if entry.info_hash not in done]
+        logger.info(f'计划中共 {len(entries)} 个种子，其中 {len(entries) - len(pending)} 个已经完成')
+        self.client_sem = asyncio.Semaphore(client_concurrency)
+        self.hashes_in_client = await self.client.get_hashes()
+        with ThreadPoolExecutor(io_threads) as self.executor:
+            rechecker = self.start_rechecker()
+            try:
+                to_add = [entry for entry in pending if entry.info_hash not in self.hashes_in_client]
+                torrents = await asyncio.gather(*(self.get_torrent(entry.tid, entry.info_hash) for entry in to_add))
+                groups = {}  # type: dict[tuple[str, bool], list[Torrent]]
+                added_torrents = {}  # type: dict[str, Torrent]
+                for entry, torrent in zip(to_add, torrents):
+                    if torrent is None:
+                        logger.error(f'Cannot get .torrent file of torrent {entry.tid}, info_hash {entry.info_hash}')
+                    else:
+                        groups.setdefault((entry.save_path, entry.paused), []).append(torrent)
+                        added_torrents[entry.info_hash] = torrent
+                for (save_path, paused), group in groups.items():
+                    for i in range(0, len(group), batch_size):
+                        batch = group[i:i + batch_size]
+                        try:
+                            await self.call_client(self.client.add_torrents, batch, save_path, paused)
+                        except Exception as e:
+                            logger.error(f'Cannot add {len(batch)} torrents -> {save_path}: {e}')
+                            continue
+                        self.hashes_in_client.update(torrent.info_hash for torrent in batch)
+                        logger.info(f'Add {len(batch)} torrents -> {save_path}')
+                if groups:
+                    # 客户端添加种子之后需要一点时间才能重命名
+                    await asyncio.sleep(0.1)
+
+                added = [entry for entry in pending if entry.info_hash in self.hashes_in_client]
+                results = await asyncio.gather(*(self.apply_ops(entry, plan_path, progress.get(entry.info_hash, 0))
+                                                 for entry in added))
+                finished = [entry.info_hash for entry, ok in zip(added, results) if ok]
+                mark_done(plan_path, finished)
+                logger.info(f'本次完成了 {len(finished)} 个种子，还有 {len(pending) - len(finished)} 个未完成')
+                # 只校验本次添加的暂停的种子，之前添加的种子可能已经在校验或做种
+                for entry, ok in zip(added, results):
+                    if ok and entry.paused and (torrent := added_torrents.get(entry.info_hash)):
+                        await self.schedule_recheck(torrent, entry.save_path)
+                await self.wait_rechecks()
+            finally:
+                if rechecker:
+                    rechecker.cancel()
+                await self.client.close()
+
+
+def ask_update(update: Update) -> bool:
+    logger.info(
+        f'当前可辅种的最新的种子 id 为 {update.newest_tid}, 是否需要更新数据？更新需要一定时间，更新后可辅种最新的种子')
+    logger.info(f'输入 y/n')
+    try:
+        return input().lower() == 'y'
+    except EOFError:
+        return False
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    def add_common(_parser: argparse.ArgumentParser, suppress: bool):
+        # 子命令前后都可以写这些选项
+        default = (lambda value: argparse.SUPPRESS) if suppress else (lambda value: value)
+        _parser.add_argument('-y', '--yes', action='store_true', default=default(False),
+                             help='辅种之前先更新数据，不再询问')
+        _parser.add_argument('--src', default=default(None),
+                             help='需要辅种的文件所在的文件夹，默认为 config.targets 或 config.src_path')
+        _parser.add_argument('--client', choices=CLIENT_TYPES, default=default(None),
+                             help='客户端类型，默认为 config.targets 或 config.client_type')
+        _parser.add_argument('--metrics', default=default(None), metavar='PATH',
+                             help='结束时把计数和耗时统计写入这个 JSON 文件')
+        _parser.add_argument('--profile', default=default(None), metavar='PATH',
+                             help='用 cProfile 运行，结束时把统计数据写入这个文件，可以用 pstats 或 snakeviz 查看')
+
+    parser = argparse.ArgumentParser(description='U2 辅种脚本，不指定命令时和以前一样先询问是否更新数据，再辅种')
+    add_common(parser, False)
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    common = argparse.ArgumentParser(add_help=False)
+    add_common(common, True)
+    subparsers.add_parser('update', parents=[common], help='只更新数据')
+    subparsers.add_parser('seed', aliases=['run'], parents=[common], help='扫描 src_path，匹配后直接添加到客户端')
+    for name, aliases, _help in (('scan', ['plan'], '扫描 src_path 并匹配，只把结果写入计划文件，不修改客户端'),
+                                 ('apply', [], '执行计划文件')):
+        subparser = subparsers.add_parser(name, aliases=aliases, parents=[common], help=_help)
+        subparser.add_argument('--plan', default='resources/plan.json', help='计划文件的路径')
+    subparsers.add_parser('watch', parents=[common], help='常驻运行，监视 src_path 并辅种新的条目')
+    subparser = subparsers.add_parser('export', parents=[common], help='把索引导出为快照或增量包，供其他节点导入')
+    subparser.add_argument('--out', default=index_export_folder, help='导出目录，默认为 config.index_export_folder')
+    subparser.add_argument('--snapshot', action='store_true', help='导出完整的快照，而不是上次导出之后的增量包')
+    subparsers.add_parser('backfill', parents=[common],
+                          help='用本地缓存和 torrents_folder 中的 .torrent 文件为以前的种子补上指纹和文件体积索引')
+    subparser = subparsers.add_parser('import', parents=[common], help='从其他节点导出的目录或 HTTP 地址导入索引')
+    subparser.add_argument('--source', default=index_source, help='导出目录或 HTTP 地址，默认为 config.index_source')
+    return parser.parse_args(argv)
+
+
+def plan_path_for(plan_path: str, i: int, count: int) -> str:
+    """
+    有多个客户端时，每个客户端一个计划文件：plan.json -> plan.1.json, plan.2.json ...
+    """
+    if count == 1:
+        return plan_path
+    root, ext = os.path.splitext(plan_path)
+    return f'{root}.{i + 1}{ext}'
+
+
+async def main(args: argparse.Namespace):
+    """
+    所有命令都在同一个事件循环中执行，更新数据和辅种共用索引、缓存和网络会话。
+    目标按客户端分组，每个客户端一个 U2AuxSeed，同时运行
+    """
+    command = {'run': 'seed', 'plan': 'scan'}.get(args.command, args.command)
+    update = get_update()
+    server = None  # type: Optional[asyncio.AbstractServer]
+    try:
+        if command == 'update':
+            await update.main()
+            return
+        if command == 'export':
+            if not args.out:
+                logger.error('需要用 --out 或 config.index_export_folder 指定导出目录')
+            elif not await asyncio.to_thread(export_index, update, args.out, args.snapshot):
+                logger.info(f'{args.out} 中已经有最新种子 {update.newest_tid} 之前的全部数据')
+            return
+        if command == 'import':
+            if not args.source:
+                logger.error('需要用 --source 或 config.index_source 指定导入的地址')
+            else:
+                logger.info(f'导入完毕，最新种子 id 为 {await import_index(update, args.source)}')
+            return
+        if command == 'backfill':
+            folder_index = open_folder_index()
+            await asyncio.to_thread(backfill, update.size_index, update.fingerprints, update.file_index,
+                                    update.torrent_cache, folder_index.hash_to_fn if folder_index else {},
+                                    torrents_folder, torrents_folder_workers)
+            if folder_index:
+                folder_index.close()
+            return
+        logger.info('欢迎使用 u2_aux_seed 脚本')
+        if args.yes or (command is None and ask_update(update)):
+            await update.main()
+
+        groups = {}  # type: dict[tuple[str, str, int], list[Target]]
+        for target in load_targets(args.src, args.client):
+            groups.setdefault(target.client_key, []).append(target)
+        for key, group in groups.items():
+            # 同一个客户端只建立一个连接，所有目标的用户名和密码必须相同
+            if len({(target.username, target.password) for target in group}) > 1:
+                raise ValueError(f'Targets of client {key[1]}:{key[2]} have different usernames or passwords')
+        folder_index = open_folder_index()
+        seeders = [U2AuxSeed([target.src_path for target in group], make_client(group[0]), folder_index)
+                   for group in groups.values()]
+        if command == 'scan':
+            coros = [seeder.run(plan_path_for(args.plan, i, len(seeders))) for i, seeder in enumerate(seeders)]
+        elif command == 'apply':
+            coros = [seeder.apply(plan_path_for(args.plan, i, len(seeders))) for i, seeder in enumerate(seeders)]
+        elif command == 'watch':
+            if metrics_port:
+                server = await metrics.serve(metrics_port)
+            coros = [seeder.watch() for seeder in seeders]
+        else:
+            coros = [seeder.run() for seeder in seeders]
+        for result in await asyncio.gather(*coros, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(f'{result}')
+    finally:
+        if server is not None:
+            server.close()
+        await update.close()
 
 
 if __name__ == '__main__':
-    asyncio.run(U2AuxSeed().run())
+    _args = parse_args()
+    _log_name = 'update' if _args.command in ('update', 'export', 'import', 'backfill') else 'main'
+    logger.add(level='DEBUG', sink=f'{os.getcwd()}/logs/{_log_name}-{{time}}.log')
+    profiler = None
+    if _args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        asyncio.run(main(_args))
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(_args.profile)
+            logger.info(f'cProfile 统计数据已写入 {_args.profile}')
+        # watch 模式按 Ctrl+C 退出时也输出统计
+        log_summary()
+        if _args.metrics:
+            metrics.dump(_args.metrics)
@@ -0,0 +1,126 @@
+"""
+为指纹和文件体积索引出现之前就已经在体积索引里的种子补上这两个索引，并补上以最大文件体积为键的体积索引记录。
+
+种子内容只来自本地的 .torrent 缓存和 torrents_folder，不访问网站。两处都没有的种子仍然没有指纹：
+匹配时这些候选排在有指纹的候选之后，文件体积投票也找不到它们，要等辅种时下载过之后才会补上。
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from utils.bencoder import BdecodeError
+from utils.fileindex import FileSizeIndex, TorrentEntry
+from utils.fingerprint import FingerprintIndex, from_sizes
+from utils.sizeindex import SizeIndex
+from utils.torrent import Torrent
+from utils.torrentcache import TorrentCache
+
+# 每次批量追加到索引的种子数
+BATCH_SIZE = 1000
+
+
+def read_file_sizes(path: str) -> Optional[tuple[str, list[int]]]:
+    """
+    返回种子的 (info hash, 按顺序排列的文件体积)，无法读取或解码时返回 None
+    """
+    try:
+        with open(path, 'rb') as fp:
+            torrent = Torrent(fp.read())
+        return torrent.info_hash, torrent.file_sizes
+    except (OSError, BdecodeError, KeyError, TypeError):
+        return None
+
+
+def find_missing(size_index: SizeIndex, fingerprints: FingerprintIndex, file_index: Optional[FileSizeIndex],
+                 cache: Optional[TorrentCache], hash_to_fn: dict[str, str], folder: str
+                 ) -> tuple[int, int, dict[str, tuple[int, set[int], str]]]:
+    """
+    返回体积索引中的种子数、缺少索引但是本地没有 .torrent 文件的种子数，
+    以及缺少指纹或者文件体积索引、并且本地有 .torrent 文件的种子 info hash -> (种子 id, 体积索引中已有的键, 文件路径)
+    """
+    torrents = {}  # type: dict[bytes, tuple[int, set[int]]]
+    for size, tid, raw_hash in size_index.items():
+        torrents.setdefault(raw_hash, (tid, set()))[1].add(size)
+    missing = {}
+    unavailable = 0
+    for raw_hash, (tid, keys) in torrents.items():
+        info_hash = raw_hash.hex()
+        if info_hash in fingerprints and (file_index is None or tid in file_index):
+            continue
+        if cache and os.path.exists(path := cache.path(info_hash)):
+            missing[info_hash] = (tid, keys, path)
+        elif fn := hash_to_fn.get(info_hash):
+            missing[info_hash] = (tid, keys, os.path.join(folder, fn))
+        else:
+            unavailable += 1
+    return len(torrents), unavailable, missing
+
+
+def read_all(paths: list[str], workers: int, chunk_size: int = 64) -> Iterator[Optional[tuple[str, list[int]]]]:
+    if workers <= 1 or len(paths) < 2 * chunk_size:
+        yield from map(read_file_sizes, paths)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(read_file_sizes, paths, chunksize=chunk_size)
+
+
+def backfill(size_index: SizeIndex, fingerprints: FingerprintIndex, file_index: Optional[FileSizeIndex],
+             cache: Optional[TorrentCache], hash_to_fn: dict[str, str], folder: str,
+             workers: int = 0) -> tuple[int, int, int]:
+    """
+    从本地的 .torrent 文件补全索引，返回补上的指纹数、文件体积索引的种子数和体积索引记录数
+    """
+    total, unavailable, missing = find_missing(size_index, fingerprints, file_index, cache, hash_to_fn, folder)
+    logger.info(f'体积索引中共 {total} 个种子，其中 {len(missing) + unavailable} 个缺少指纹或文件体积索引，'
+                f'{len(missing)} 个在本地有 .torrent 文件')
+    items = list(missing.items())
+    added = [0, 0, 0]
+    fps, torrents, sizes = [], [], []
+
+    def flush():
+        added[0] += fingerprints.add_many(fps)
+        if file_index is not None:
+            added[1] += file_index.add_many(torrents)
+        added[2] += size_index.add_many(sizes)
+        fps.clear()
+        torrents.clear()
+        sizes.clear()
+
+    start = last_log = time.perf_counter()
+    failed = done = 0
+    for (info_hash, (tid, keys, path)), result in zip(items, read_all([item[1][2] for item in items],
+                                                                   workers or os.cpu_count() or 1)):
+        done += 1
+        if result is None or result[0] != info_hash:
+            # 缓存或者 torrents_folder 中的文件损坏，或者文件名和内容对不上
+            failed += 1
+            continue
+        raw_hash = bytes.fromhex(info_hash)
+        file_sizes = result[1]
+        fp = from_sizes(file_sizes)
+        fps.append((raw_hash, fp))
+        if file_index is not None:
+            files = [(size, i) for i, size in enumerate(file_sizes) if size >= file_index.min_size]
+            torrents.append((TorrentEntry(tid, fp.total, sum(size for size, _ in files), raw_hash), files))
+        if fp.top_sizes and fp.top_sizes[0] not in keys:
+            # 以前的种子按 duplicate_sizes 规则取键，补上新种子使用的最大文件体积的键
+            sizes.append((fp.top_sizes[0], tid, raw_hash))
+        if len(fps) >= BATCH_SIZE:
+            flush()
+            if (now := time.perf_counter()) - last_log >= 5:
+                last_log = now
+                logger.info(f'已读取 {done}/{len(items)} 个 .torrent 文件')
+    flush()
+    if failed:
+        logger.warning(f'{failed} 个 .torrent 文件无法读取、解码或者 info hash 不一致')
+    size_index.compact()
+    fingerprints.compact()
+    if file_index is not None:
+        file_index.compact()
+    logger.info(f'补全了 {added[0]} 个指纹、{added[1]} 个文件体积索引的种子、{added[2]} 条体积索引记录，'
+                f'用时 {time.perf_counter() - start:.1f}s；还有 {unavailable + failed} 个种子'
+                f'没有可用的本地 .torrent 文件，要等辅种时下载之后才有指纹')
+    return added[0], added[1], added[2]
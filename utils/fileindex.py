@@ -0,0 +1,278 @@
+"""
+文件体积 -> (种子 id, 文件序号) 的反向索引，收录每个种子中所有不小于 min_size 的文件。
+
+体积索引只收录最大的文件，缺少最大文件的文件夹，或者散落在 src_path 下的单个文件都找不到对应的种子。
+这个索引按体积投票：本地每个文件的体积给包含同样体积文件的种子投票，按匹配上的体积估算缺失的体积。
+
+基础段和体积索引一样是 mmap 映射的列式定长数组，不需要解析：
+
+- 文件表按体积排序：int64 体积、uint32 种子 id、uint32 文件序号
+- 种子表按种子 id 排序：uint32 种子 id、int64 总体积、int64 收录文件的总体积、20 字节 info hash
+
+增量段每个种子一条变长记录：种子表的一行，后面跟着收录的文件数和 (体积, 文件序号)。
+"""
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from utils.sizeindex import file_signature
+
+MAGIC = b'U2FI'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQQ')  # magic, version, min_size, 文件数, 种子数
+TORRENT = struct.Struct('<Iqq20sI')  # 种子 id, 总体积, 收录文件的总体积, info hash, 收录的文件数
+FILE = struct.Struct('<qI')  # 体积, 文件序号
+HASH_LEN = 20
+
+
+class TorrentEntry(NamedTuple):
+    tid: int
+    total: int
+    indexed: int
+    info_hash: bytes
+
+
+class Vote(NamedTuple):
+    tid: int
+    info_hash: str
+    matched: int
+    missing: int
+
+
+class FileSizeIndex:
+    def __init__(self, path: str = 'resources/file_index.bin', min_size: int = 100 * 1024 ** 2):
+        """
+        Args:
+            path: 基础段路径，增量段为 ``<path>.delta``
+            min_size: 收录的最小文件体积，小文件体积重复太多，投票没有意义
+        """
+        self.path = path
+        self.delta_path = f'{path}.delta'
+        self.min_size = min_size
+        self._file = None
+        self._mmap = None
+        self._sizes = self._file_tids = self._file_indexes = None
+        self._tids = self._totals = self._indexed = self._hashes = None
+        self._file_count = self._torrent_count = 0
+        self._delta_files = {}  # type: dict[int, list[tuple[int, int]]]
+        self._delta_torrents = {}  # type: dict[int, TorrentEntry]
+        self._signature = ()
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            write_base(self.path, self.min_size, (), ())
+        self._signature = file_signature(self.path, self.delta_path)
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, min_size, file_count, torrent_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a file size index file')
+        if min_size != self.min_size:
+            raise ValueError(f'{self.path} was built with min_size {min_size}, delete it to rebuild')
+        view = memoryview(self._mmap)
+        off = HEADER.size
+        columns = []
+        for fmt, count in (('q', file_count), ('I', file_count), ('I', file_count),
+                           ('I', torrent_count), ('q', torrent_count), ('q', torrent_count)):
+            itemsize = 8 if fmt == 'q' else 4
+            columns.append(view[off:off + itemsize * count].cast(fmt))
+            off += itemsize * count
+        self._sizes, self._file_tids, self._file_indexes, self._tids, self._totals, self._indexed = columns
+        self._hashes = view[off:off + HASH_LEN * torrent_count]
+        self._file_count = file_count
+        self._torrent_count = torrent_count
+
+        self._delta_files.clear()
+        self._delta_torrents.clear()
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, 'rb') as fp:
+                data = fp.read()
+            off = 0
+            # 忽略崩溃时写了一半的记录
+            while off + TORRENT.size <= len(data):
+                tid, total, indexed, info_hash, n = TORRENT.unpack_from(data, off)
+                end = off + TORRENT.size + n * FILE.size
+                if end > len(data):
+                    break
+                files = FILE.iter_unpack(data[off + TORRENT.size:end])
+                self._add_delta(TorrentEntry(tid, total, indexed, info_hash), files)
+                off = end
+
+    def _add_delta(self, entry: TorrentEntry, files: Iterable[tuple[int, int]]):
+        self._delta_torrents[entry.tid] = entry
+        for size, file_index in files:
+            self._delta_files.setdefault(size, []).append((entry.tid, file_index))
+
+    def close(self):
+        if self._mmap is not None:
+            for column in (self._sizes, self._file_tids, self._file_indexes,
+                           self._tids, self._totals, self._indexed, self._hashes):
+                column.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def reload(self) -> bool:
+        """
+        基础段或增量段被其他进程修改过时重新打开，返回是否重新打开
+        """
+        if file_signature(self.path, self.delta_path) == self._signature:
+            return False
+        self.close()
+        self._open()
+        return True
+
+    def __len__(self):
+        return self._torrent_count + len(self._delta_torrents)
+
+    def __contains__(self, tid: int):
+        return self.get_torrent(tid) is not None
+
+    def get_torrent(self, tid: int) -> Optional[TorrentEntry]:
+        if entry := self._delta_torrents.get(tid):
+            return entry
+        i = bisect_left(self._tids, tid)
+        if i < self._torrent_count and self._tids[i] == tid:
+            return TorrentEntry(tid, self._totals[i], self._indexed[i],
+                                bytes(self._hashes[i * HASH_LEN:(i + 1) * HASH_LEN]))
+        return None
+
+    def get(self, size: int) -> list[tuple[int, int]]:
+        """
+        返回包含体积为 size 的文件的 (种子 id, 文件序号)
+        """
+        lo = bisect_left(self._sizes, size)
+        hi = bisect_right(self._sizes, size, lo)
+        result = [(self._file_tids[i], self._file_indexes[i]) for i in range(lo, hi)]
+        if delta := self._delta_files.get(size):
+            result.extend(delta)
+        return result
+
+    def add(self, tid: int, info_hash: str, sizes: list[int]):
+        """
+        收录一个种子，sizes 为种子中按顺序排列的所有文件体积，已经收录的种子会被忽略
+        """
+        if tid in self:
+            return
+        files = [(size, i) for i, size in enumerate(sizes) if size >= self.min_size]
+        entry = TorrentEntry(tid, sum(sizes), sum(size for size, _ in files), bytes.fromhex(info_hash))
+        data = bytearray(TORRENT.pack(*entry, len(files)))
+        for file in files:
+            data += FILE.pack(*file)
+        with open(self.delta_path, 'ab') as fp:
+            fp.write(data)
+        self._add_delta(entry, files)
+
+    def add_many(self, torrents: Iterable[tuple[TorrentEntry, list[tuple[int, int]]]]) -> int:
+        """
+        批量收录 (种子, [(体积, 文件序号), ...])，文件需要已经按 min_size 筛选过，已经收录的种子跳过，返回收录的数量
+        """
+        data = bytearray()
+        count = 0
+        for entry, files in torrents:
+            if entry.tid in self:
+                continue
+            data += TORRENT.pack(*entry, len(files))
+            for file in files:
+                data += FILE.pack(*file)
+            self._add_delta(entry, files)
+            count += 1
+        if data:
+            with open(self.delta_path, 'ab') as fp:
+                fp.write(data)
+        return count
+
+    def vote(self, sizes: Iterable[int], max_missing_size: int, limit: int = 10) -> list[Vote]:
+        """
+        用本地文件的体积投票，返回估算缺失体积不超过 max_missing_size 的种子，按缺失体积从小到大排列，最多 limit 个。
+
+        种子中每个文件最多和一个本地文件匹配；没有收录的小文件假设都能用本地剩下的小文件补上，所以缺失体积是下限
+        """
+        local = Counter(sizes)
+        small_bytes = sum(size * n for size, n in local.items() if size < self.min_size)
+        counts = {}  # type: dict[int, Counter]
+        for size in local:
+            if size < self.min_size:
+                continue
+            for tid, _ in self.get(size):
+                counts.setdefault(tid, Counter())[size] += 1
+        votes = []
+        for tid, files in counts.items():
+            entry = self.get_torrent(tid)
+            matched = sum(size * min(n, local[size]) for size, n in files.items())
+            missing = entry.indexed - matched + max(0, entry.total - entry.indexed - small_bytes)
+            if missing <= max_missing_size:
+                votes.append(Vote(tid, entry.info_hash.hex(), matched, missing))
+        votes.sort(key=lambda vote: (vote.missing, -vote.matched))
+        return votes[:limit]
+
+    def files(self) -> Iterator[tuple[int, int, int]]:
+        """
+        按体积顺序遍历所有文件 (体积, 种子 id, 文件序号)
+        """
+        delta = sorted((size, tid, i) for size, files in self._delta_files.items() for tid, i in files)
+        j = 0
+        for i in range(self._file_count):
+            size = self._sizes[i]
+            while j < len(delta) and delta[j][0] < size:
+                yield delta[j]
+                j += 1
+            yield size, self._file_tids[i], self._file_indexes[i]
+        yield from delta[j:]
+
+    def torrents(self) -> Iterator[TorrentEntry]:
+        """
+        按种子 id 顺序遍历所有种子
+        """
+        base = (TorrentEntry(self._tids[i], self._totals[i], self._indexed[i],
+                             bytes(self._hashes[i * HASH_LEN:(i + 1) * HASH_LEN])) for i in range(self._torrent_count))
+        delta = sorted(self._delta_torrents.values())
+        j = 0
+        for entry in base:
+            while j < len(delta) and delta[j].tid < entry.tid:
+                yield delta[j]
+                j += 1
+            yield entry
+        yield from delta[j:]
+
+    def compact(self, force: bool = False, threshold: int = 1024):
+        """
+        增量段中的种子数超过 threshold(或者 force 为 True)时合并进基础段
+        """
+        if not self._delta_torrents or (not force and len(self._delta_torrents) < threshold):
+            return
+        files = list(self.files())
+        torrents = list(self.torrents())
+        self.close()
+        write_base(self.path, self.min_size, files, torrents)
+        os.remove(self.delta_path)
+        self._open()
+
+
+def write_base(path: str, min_size: int, files: Iterable[tuple[int, int, int]], torrents: Iterable[TorrentEntry]):
+    """
+    写入基础段，files 需要按体积排序，torrents 需要按种子 id 排序
+    """
+    sizes, file_tids, file_indexes = array('q'), array('I'), array('I')
+    for size, tid, i in files:
+        sizes.append(size)
+        file_tids.append(tid)
+        file_indexes.append(i)
+    tids, totals, indexed, hashes = array('I'), array('q'), array('q'), bytearray()
+    for entry in torrents:
+        tids.append(entry.tid)
+        totals.append(entry.total)
+        indexed.append(entry.indexed)
+        hashes += entry.info_hash
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, min_size, len(sizes), len(tids)))
+        for column in (sizes, file_tids, file_indexes, tids, totals, indexed):
+            fp.write(column.tobytes())
+        fp.write(hashes)
+    os.replace(tmp_path, path)
@@ -0,0 +1,134 @@
+"""
+把多文件种子中的文件对应到本地文件夹里的文件，得到需要在客户端中执行的重命名。
+
+本地文件按路径、(体积, 文件名) 和体积建立字典，种子中的文件按体积从大到小依次匹配；
+已经确定的文件夹重命名保存在以路径各级组成的元组为键的字典里，种子路径按最长前缀改写，
+整个过程与文件数量近似线性，同体积的多个文件各自只匹配一次。
+"""
+import os
+from typing import Callable, Mapping, Optional
+
+Parts = tuple[str, ...]
+
+# 小于这个体积的文件只按路径匹配，不用来推断重命名
+RENAME_MIN_SIZE = 4 * 1024 ** 2
+
+
+class FileMatch:
+    """
+    Attributes:
+        renames: 种子中的路径 -> 本地路径，都相对于文件夹所在的目录，文件夹以分隔符结尾；
+            按顺序执行，后面的键是前面的重命名执行之后的路径
+        matched: 匹配上的本地文件的完整路径
+        missing_size: 种子中没有匹配上的文件的总体积
+        local_files: 种子中每个文件对应的本地文件的完整路径，按种子中的顺序，没有匹配上的为 None
+    """
+    __slots__ = ('renames', 'matched', 'missing_size', 'local_files')
+
+    def __init__(self, renames: dict[str, str], matched: set[str], missing_size: int,
+                 local_files: list[Optional[str]]):
+        self.renames = renames
+        self.matched = matched
+        self.missing_size = missing_size
+        self.local_files = local_files
+
+
+def _common_suffix(a: Parts, b: Parts) -> int:
+    """
+    两个路径末尾相同的层数，至少保留一层不算在内
+    """
+    n = 0
+    limit = min(len(a), len(b)) - 1
+    while n < limit and a[-1 - n] == b[-1 - n]:
+        n += 1
+    return n
+
+
+def match_files(path: str, name: str, file_list: list[str], sizes: Mapping[str, int],
+                torrent_files: list[dict[bytes, int | list[bytes]]],
+                decode_name: Callable[[bytes], str]) -> FileMatch:
+    """
+    Args:
+        path: 本地文件夹
+        name: 种子的名字(种子中的根文件夹)
+        file_list: 还没有匹配的本地文件的完整路径
+        sizes: 本地文件的完整路径 -> 体积
+        torrent_files: 种子 info 中的 files
+        decode_name: 解码种子中的文件名
+    """
+    base_path = os.path.dirname(path)
+    offset = len(base_path) + 1 if base_path else 0
+
+    local = {}  # type: dict[Parts, str]
+    by_name = {}  # type: dict[tuple[int, str], list[Parts]]
+    by_size = {}  # type: dict[int, list[Parts]]
+    for file in file_list:
+        parts = tuple(file[offset:].split(os.sep))
+        size = sizes[file]
+        local[parts] = file
+        by_name.setdefault((size, parts[-1]), []).append(parts)
+        by_size.setdefault(size, []).append(parts)
+    used = set()  # type: set[Parts]
+
+    files = []  # type: list[tuple[int, Parts, int]]
+    for i, file in enumerate(torrent_files):
+        parts = (name, *map(decode_name, file[b'path']))
+        files.append((file[b'length'], parts, i))
+    files.sort(key=lambda file: file[0], reverse=True)
+
+    dir_map = {}  # type: dict[Parts, Parts]
+    file_map = {}  # type: dict[Parts, Parts]
+    renames = {}  # type: dict[str, str]
+    # 已经对应好的文件在种子中的路径及其所有上级文件夹
+    fixed = set()  # type: set[Parts]
+
+    def map_path(parts: Parts) -> Parts:
+        if (mapped := file_map.get(parts)) is not None:
+            return mapped
+        for i in range(len(parts) - 1, 0, -1):
+            if (mapped := dir_map.get(parts[:i])) is not None:
+                return mapped + parts[i:]
+        return parts
+
+    def pick(candidates: Optional[list[Parts]], parts: Parts) -> Optional[Parts]:
+        # 同名同体积的文件有多个时，选末尾路径最接近的
+        best = None
+        best_score = -1
+        for candidate in candidates or ():
+            if candidate not in used and (score := _common_suffix(candidate, parts)) > best_score:
+                best, best_score = candidate, score
+        return best
+
+    for size, parts, _ in files:
+        if size <= RENAME_MIN_SIZE:
+            break
+        mapped = map_path(parts)
+        if mapped in local and mapped not in used and sizes[local[mapped]] == size:
+            used.add(mapped)
+        elif target := pick(by_name.get((size, parts[-1])), mapped) or pick(by_size.get(size), mapped):
+            used.add(target)
+            # 只能改写种子路径中没有被之前的重命名改变过的部分
+            n = min(_common_suffix(mapped, target), _common_suffix(parts, mapped))
+            source_dir = parts[:len(parts) - n]
+            if n and source_dir not in fixed:
+                dir_map[source_dir] = target[:len(target) - n]
+                renames[os.sep.join(mapped[:len(mapped) - n]) + os.sep] = os.sep.join(target[:len(target) - n]) + os.sep
+            else:
+                # 文件夹里已经有对应好的文件，重命名文件夹会破坏之前的结果，只能单独重命名这个文件
+                file_map[parts] = target
+                renames[os.sep.join(mapped)] = os.sep.join(target)
+        else:
+            continue
+        fixed.update(parts[:i] for i in range(1, len(parts) + 1))
+
+    matched = set()
+    missing_size = 0
+    local_files = [None] * len(files)  # type: list[Optional[str]]
+    for size, parts, i in files:
+        mapped = map_path(parts)
+        if (file := local.get(mapped)) is not None and file not in matched and sizes[file] == size:
+            matched.add(file)
+            local_files[i] = file
+        else:
+            missing_size += size
+    return FileMatch(renames, matched, missing_size, local_files)
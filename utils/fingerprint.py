@@ -0,0 +1,206 @@
+"""
+种子的体积指纹：文件数、总体积和最大的 TOP_K 个文件体积。
+
+体积索引只能按最大文件体积找到候选种子，热门体积对应的候选很多。有了指纹，
+不需要下载种子就能和本地扫描到的文件比较，估算缺失的体积，排除不可能匹配的候选并排序。
+
+指纹文件的格式和体积索引相同：按 info hash 排序的定长记录组成的基础段(mmap 后二分查找)，加上追加写入的增量段。
+"""
+import mmap
+import os
+import struct
+from collections import Counter
+from typing import Any, Iterable, NamedTuple, Optional
+
+from utils.sizeindex import file_signature
+
+TOP_K = 4
+MAGIC = b'U2FP'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')  # magic, version, count
+RECORD = struct.Struct(f'<20sIq{TOP_K}q')  # info hash, 文件数, 总体积, 最大的 TOP_K 个文件体积(不足补 0)
+
+
+class Fingerprint(NamedTuple):
+    count: int
+    total: int
+    top_sizes: tuple[int, ...]
+
+    def missing_size(self, local_sizes: Counter) -> int:
+        """
+        估算本地缺失体积的下限：最大的几个文件中本地没有的体积，
+        加上其余文件中本地剩下的(不大于这几个文件的)文件放不下的体积
+        """
+        used = Counter()
+        missing = 0
+        for size in self.top_sizes:
+            if used[size] < local_sizes[size]:
+                used[size] += 1
+            else:
+                missing += size
+        rest = self.total - sum(self.top_sizes)
+        if rest > 0:
+            limit = self.top_sizes[-1]
+            local_rest = sum(size * (n - used[size]) for size, n in local_sizes.items() if size <= limit)
+            missing += max(0, rest - local_rest)
+        return missing
+
+
+def _from_record(record: tuple) -> Fingerprint:
+    return Fingerprint(record[1], record[2], tuple(size for size in record[3:] if size))
+
+
+def fingerprint(info_dict: dict[bytes, Any]) -> Fingerprint:
+    if b'files' in info_dict:
+        return from_sizes([file[b'length'] for file in info_dict[b'files']])
+    return from_sizes([info_dict[b'length']])
+
+
+def from_sizes(sizes: Iterable[int]) -> Fingerprint:
+    sizes = sorted(sizes, reverse=True)
+    return Fingerprint(len(sizes), sum(sizes), tuple(sizes[:TOP_K]))
+
+
+def rank_candidates(candidates: Iterable[tuple[int, str]], index: 'FingerprintIndex', local_sizes: Counter,
+                    max_missing_size: int) -> list[tuple[int, str]]:
+    """
+    去掉估算缺失体积超过 max_missing_size 的候选，其余按缺失体积从小到大排序，没有指纹的候选排在最后
+    """
+    ranked = []
+    for i, (tid, info_hash) in enumerate(candidates):
+        if fp := index.get(info_hash):
+            if (missing := fp.missing_size(local_sizes)) > max_missing_size:
+                continue
+            ranked.append((missing, i, tid, info_hash))
+        else:
+            ranked.append((float('inf'), i, tid, info_hash))
+    ranked.sort()
+    return [(tid, info_hash) for _, _, tid, info_hash in ranked]
+
+
+class FingerprintIndex:
+    def __init__(self, path: str = 'resources/fingerprint.bin', compact_threshold: int = 4096):
+        self.path = path
+        self.delta_path = f'{path}.delta'
+        self.compact_threshold = compact_threshold
+        self._file = None
+        self._mmap = None
+        self._count = 0
+        self._delta = {}  # type: dict[bytes, Fingerprint]
+        self._signature = ()
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            write_base(self.path, ())
+        self._signature = file_signature(self.path, self.delta_path)
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a fingerprint file')
+        self._delta.clear()
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, 'rb') as fp:
+                data = fp.read()
+            for record in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+                self._delta[record[0]] = _from_record(record)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def reload(self) -> bool:
+        """
+        基础段或增量段被其他进程修改过时重新打开，返回是否重新打开
+        """
+        if file_signature(self.path, self.delta_path) == self._signature:
+            return False
+        self.close()
+        self._open()
+        return True
+
+    def __len__(self):
+        return self._count + len(self._delta)
+
+    def _find(self, raw_hash: bytes) -> Optional[Fingerprint]:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = HEADER.size + mid * RECORD.size
+            key = self._mmap[off:off + 20]
+            if key < raw_hash:
+                lo = mid + 1
+            elif key > raw_hash:
+                hi = mid
+            else:
+                record = RECORD.unpack_from(self._mmap, off)
+                return _from_record(record)
+        return None
+
+    def get(self, info_hash: str) -> Optional[Fingerprint]:
+        raw_hash = bytes.fromhex(info_hash)
+        return self._delta.get(raw_hash) or self._find(raw_hash)
+
+    def __contains__(self, info_hash: str):
+        return self.get(info_hash) is not None
+
+    def add(self, info_hash: str, fp: Fingerprint):
+        raw_hash = bytes.fromhex(info_hash)
+        if raw_hash in self._delta or self._find(raw_hash):
+            return
+        with open(self.delta_path, 'ab') as f:
+            f.write(RECORD.pack(raw_hash, fp.count, fp.total, *fp.top_sizes, *(0,) * (TOP_K - len(fp.top_sizes))))
+        self._delta[raw_hash] = fp
+
+    def add_many(self, records: Iterable[tuple[bytes, Fingerprint]]) -> int:
+        """
+        批量追加 (原始 info hash, 指纹)，已经存在的跳过，返回追加的数量
+        """
+        data = bytearray()
+        count = 0
+        for raw_hash, fp in records:
+            if raw_hash in self._delta or self._find(raw_hash):
+                continue
+            data += RECORD.pack(raw_hash, fp.count, fp.total, *fp.top_sizes, *(0,) * (TOP_K - len(fp.top_sizes)))
+            self._delta[raw_hash] = fp
+            count += 1
+        if data:
+            with open(self.delta_path, 'ab') as f:
+                f.write(data)
+        return count
+
+    def items(self) -> Iterable[tuple[bytes, Fingerprint]]:
+        records = {}
+        for i in range(self._count):
+            record = RECORD.unpack_from(self._mmap, HEADER.size + i * RECORD.size)
+            records[record[0]] = _from_record(record)
+        records.update(self._delta)
+        return sorted(records.items())
+
+    def compact(self, force: bool = False):
+        if not self._delta or (not force and len(self._delta) < self.compact_threshold):
+            return
+        records = self.items()
+        self.close()
+        write_base(self.path, records)
+        os.remove(self.delta_path)
+        self._open()
+
+
+def write_base(path: str, records: Iterable[tuple[bytes, Fingerprint]]):
+    """
+    写入基础段，records 需要已按 info hash 排序
+    """
+    data = bytearray()
+    count = 0
+    for raw_hash, fp in records:
+        data += RECORD.pack(raw_hash, fp.count, fp.total, *fp.top_sizes, *(0,) * (TOP_K - len(fp.top_sizes)))
+        count += 1
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, count))
+        f.write(data)
+    os.replace(tmp_path, path)
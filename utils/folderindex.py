@@ -0,0 +1,159 @@
+"""
+torrents_folder 中 .torrent 文件的持久化索引。
+
+每个文件以 (路径, 文件大小, mtime) 为准缓存 info hash 和最大文件体积，
+启动时只需要 scandir 一遍目录，解码新增或者改动过的文件。
+watch 模式在线程池中刷新，数据库连接可以在任意线程使用，每条语句都在 self.lock 中执行。
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from utils.bencoder import BdecodeError
+from utils.torrent import Torrent
+
+
+def read_torrent_file(path: str) -> tuple[Optional[str], int]:
+    """
+    返回 (info hash, 最大文件体积)，无法解码时返回 (None, 0)
+    """
+    try:
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        torrent = Torrent(content)
+        return torrent.info_hash, torrent.max_size
+    except (OSError, BdecodeError, KeyError, TypeError):
+        return None, 0
+
+
+class TorrentFolderIndex:
+    def __init__(self, folder: str, db_path: str = 'resources/torrents_folder.db', workers: int = 0):
+        """
+        Args:
+            folder: 存放 .torrent 文件的目录
+            db_path: 缓存数据库路径
+            workers: 读取文件的进程数，0 表示 CPU 核数
+        """
+        self.folder = folder
+        self.workers = workers or os.cpu_count() or 1
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        # 多个客户端共用一个索引，同一时间只有一个线程在刷新
+        self.refresh_lock = threading.Lock()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS torrents ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, info_hash TEXT, max_size INTEGER)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS torrents_max_size ON torrents (max_size)')
+        self.hash_to_fn = {}  # type: dict[str, str]
+
+    def scan(self) -> list[tuple[str, int, int]]:
+        """
+        返回新增或改动过的文件 (路径, 文件大小, mtime)，同时删除已经不存在的文件的记录
+        """
+        with self.lock:
+            cached = {path: (size, mtime_ns) for path, size, mtime_ns in self.db.execute(
+                'SELECT path, size, mtime_ns FROM torrents')}
+        changed = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith('.torrent') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if cached.pop(entry.path, None) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        if cached:
+            with self.lock:
+                self.db.executemany('DELETE FROM torrents WHERE path = ?', ((path,) for path in cached))
+        return changed
+
+    def read_files(self, paths: list[str], chunk_size: int = 64) -> Iterator[tuple[Optional[str], int]]:
+        """
+        按顺序返回每个文件的 read_torrent_file 结果，文件较多时分块交给进程池处理
+        """
+        if self.workers <= 1 or len(paths) < 2 * chunk_size:
+            yield from map(read_torrent_file, paths)
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            yield from executor.map(read_torrent_file, paths, chunksize=chunk_size)
+
+    def refresh(self) -> int:
+        """
+        增量更新索引并重建 hash_to_fn，返回重新读取的文件数。
+        其他线程正在刷新时等它完成后直接返回 0，不再重复扫描
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            with self.refresh_lock:
+                return 0
+        try:
+            return self._refresh()
+        finally:
+            self.refresh_lock.release()
+
+    def _refresh(self) -> int:
+        changed = self.scan()
+        total_bytes = sum(size for _, size, _ in changed)
+        start = last_log = time.perf_counter()
+        done = done_bytes = 0
+        failed = []
+        rows = []
+        for (path, size, mtime_ns), (info_hash, max_size) in zip(changed, self.read_files([c[0] for c in changed])):
+            rows.append((path, size, mtime_ns, info_hash, max_size))
+            if info_hash is None:
+                failed.append(path)
+            done += 1
+            done_bytes += size
+            if len(rows) >= 1000:
+                with self.lock:
+                    self.db.executemany('INSERT OR REPLACE INTO torrents VALUES (?, ?, ?, ?, ?)', rows)
+                rows.clear()
+            if (now := time.perf_counter()) - last_log >= 5:
+                last_log = now
+                logger.info(f'已读取 {done}/{len(changed)} 个 .torrent 文件, '
+                            f'{done / (now - start):.0f} files/s, {done_bytes / (now - start) / 1024 ** 2:.1f} MB/s')
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO torrents VALUES (?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+        if changed:
+            elapsed = time.perf_counter() - start
+            logger.info(f'读取 {len(changed)} 个 .torrent 文件({total_bytes / 1024 ** 2:.1f} MB)用时 {elapsed:.1f}s, '
+                        f'{len(changed) / elapsed:.0f} files/s, {total_bytes / elapsed / 1024 ** 2:.1f} MB/s')
+        if failed:
+            logger.warning(f'{len(failed)} 个 .torrent 文件无法读取或解码')
+            for path in failed:
+                logger.debug(f'Cannot read .torrent file {path}')
+        with self.lock:
+            self.hash_to_fn = {
+                info_hash: os.path.basename(path)
+                for path, info_hash in self.db.execute(
+                    'SELECT path, info_hash FROM torrents WHERE info_hash IS NOT NULL')
+            }
+        return len(changed)
+
+    def forget(self, fn: str):
+        """
+        辅种时无法读取的文件不再出现在 hash_to_fn 中，记录保留文件大小和 mtime，文件改动之后刷新时才重新读取
+        """
+        path = os.path.join(self.folder, fn)
+        with self.lock:
+            self.db.execute('UPDATE torrents SET info_hash = NULL, max_size = 0 WHERE path = ?', (path,))
+            self.db.commit()
+            for info_hash in [info_hash for info_hash, name in self.hash_to_fn.items() if name == fn]:
+                del self.hash_to_fn[info_hash]
+
+    def get(self, max_size: int) -> list[str]:
+        """
+        返回目录中最大文件体积为 max_size 的种子的 info hash
+        """
+        with self.lock:
+            return [info_hash for info_hash, in self.db.execute(
+                'SELECT info_hash FROM torrents WHERE max_size = ? AND info_hash IS NOT NULL', (max_size,))]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
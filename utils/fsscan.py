@@ -0,0 +1,97 @@
+"""
+src_path 下每个条目只用 os.scandir 扫描一遍，得到不可变的快照，之后的匹配都从快照里取路径和体积，不再 stat。
+"""
+import os
+from types import MappingProxyType
+from typing import Sequence
+
+from config import duplicate_sizes
+from utils.metrics import metrics
+
+
+class FolderSnapshot:
+    """
+    一个文件或者文件夹的扫描结果
+
+    Attributes:
+        root: 扫描的路径
+        is_dir: root 是否为文件夹
+        sizes: 文件路径 -> 体积，顺序与 os.walk 相同
+        sorted_sizes: 所有文件体积，从大到小排列
+    """
+    __slots__ = ('root', 'is_dir', 'sizes', 'sorted_sizes')
+
+    def __init__(self, root: str, is_dir: bool, sizes: dict[str, int]):
+        self.root = root
+        self.is_dir = is_dir
+        self.sizes = MappingProxyType(sizes)
+        self.sorted_sizes = tuple(sorted(sizes.values(), reverse=True))
+
+    def __len__(self):
+        return len(self.sizes)
+
+
+def legacy_key(sorted_sizes: Sequence[int]) -> int:
+    if not sorted_sizes:
+        return 0
+    max_size = sorted_sizes[0]
+    if max_size in duplicate_sizes:
+        for size in sorted_sizes:
+            if size != max_size:
+                return size
+    return max_size
+
+
+def index_keys(sorted_sizes: Sequence[int]) -> tuple[int, ...]:
+    """
+    在体积索引中查找的键：最大的体积，以及有指纹之前按 duplicate_sizes 规则得到的旧键
+    """
+    if not sorted_sizes:
+        return ()
+    key = legacy_key(sorted_sizes)
+    return (sorted_sizes[0],) if key == sorted_sizes[0] else (sorted_sizes[0], key)
+
+
+def scan(path: str) -> FolderSnapshot:
+    """
+    扫描文件或文件夹，和 os.walk 一样不进入指向文件夹的符号链接，无法 stat 的文件会被跳过
+    """
+    with metrics.time('fs_scan'):
+        snapshot = _scan(path)
+    metrics.inc('fs_scan_files', len(snapshot.sizes))
+    metrics.inc('fs_scan_bytes', sum(snapshot.sizes.values()))
+    return snapshot
+
+
+def _scan(path: str) -> FolderSnapshot:
+    sizes = {}
+    if not os.path.isdir(path):
+        try:
+            sizes[path] = os.path.getsize(path)
+        except OSError:
+            pass
+        return FolderSnapshot(path, False, sizes)
+
+    stack = [path]
+    entries = 0
+    while stack:
+        dirs = []
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    entries += 1
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                dirs.append(entry.path)
+                        else:
+                            sizes[entry.path] = entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            continue
+        stack.extend(reversed(dirs))
+    # 文件的 stat 次数，文件夹的类型在 scandir 中已经得到，不需要 stat
+    metrics.inc('fs_scan_entries', entries)
+    metrics.inc('fs_scan_stats', len(sizes))
+    return FolderSnapshot(path, True, sizes)
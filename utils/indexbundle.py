@@ -0,0 +1,126 @@
+"""
+索引的导出包：种子 id 在 (from_tid, to_tid] 之间的种子在体积索引、指纹和文件体积索引中的全部记录。
+from_tid 为 0 的是快照，其余的是增量包。导入时把记录追加到各个索引的增量段，耗时只和包的大小有关。
+
+文件格式：头部、zlib 压缩的记录、整个文件前面部分的 SHA-256。记录直接使用各个索引自己的定长格式：
+
+- 体积索引：体积、种子 id、info hash
+- 指纹：info hash、文件数、总体积、最大的几个文件体积
+- 文件体积索引：种子表的一行和收录的文件数，后面跟着 (体积, 文件序号)
+"""
+import hashlib
+import struct
+import zlib
+from typing import NamedTuple, Optional
+
+from utils import fileindex, fingerprint, sizeindex
+from utils.fileindex import FileSizeIndex, TorrentEntry
+from utils.fingerprint import Fingerprint, FingerprintIndex, TOP_K
+from utils.sizeindex import SizeIndex
+
+MAGIC = b'U2IB'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQIII')  # magic, version, from_tid, to_tid, min_size, 体积记录数, 指纹数, 文件体积索引的种子数
+DIGEST_LEN = 32
+
+
+class Bundle(NamedTuple):
+    from_tid: int
+    to_tid: int
+    min_size: int  # 文件体积索引收录的最小体积，没有文件体积索引时为 0
+    sizes: list[tuple[int, int, bytes]]
+    fingerprints: list[tuple[bytes, Fingerprint]]
+    torrents: list[tuple[TorrentEntry, list[tuple[int, int]]]]
+
+
+def collect(size_index: SizeIndex, fingerprints: FingerprintIndex, file_index: Optional[FileSizeIndex],
+            from_tid: int, to_tid: int) -> Bundle:
+    """
+    从本地索引中取出种子 id 在 (from_tid, to_tid] 之间的记录，需要遍历整个索引
+    """
+    sizes = list(dict.fromkeys(record for record in size_index.items() if from_tid < record[1] <= to_tid))
+    fps = []
+    for raw_hash in sorted({record[2] for record in sizes}):
+        if (fp := fingerprints.get(raw_hash.hex())) is not None:
+            fps.append((raw_hash, fp))
+    torrents = []
+    if file_index is not None:
+        files = {}  # type: dict[int, list[tuple[int, int]]]
+        for size, tid, i in file_index.files():
+            if from_tid < tid <= to_tid:
+                files.setdefault(tid, []).append((size, i))
+        for entry in file_index.torrents():
+            if from_tid < entry.tid <= to_tid:
+                torrents.append((entry, sorted(files.get(entry.tid, ()), key=lambda file: file[1])))
+    return Bundle(from_tid, to_tid, file_index.min_size if file_index is not None else 0, sizes, fps, torrents)
+
+
+def encode(bundle: Bundle) -> bytes:
+    payload = bytearray()
+    for record in bundle.sizes:
+        payload += sizeindex.RECORD.pack(*record)
+    for raw_hash, fp in bundle.fingerprints:
+        payload += fingerprint.RECORD.pack(raw_hash, fp.count, fp.total, *fp.top_sizes,
+                                           *(0,) * (TOP_K - len(fp.top_sizes)))
+    for entry, files in bundle.torrents:
+        payload += fileindex.TORRENT.pack(*entry, len(files))
+        for file in files:
+            payload += fileindex.FILE.pack(*file)
+    data = HEADER.pack(MAGIC, VERSION, bundle.from_tid, bundle.to_tid, bundle.min_size, len(bundle.sizes),
+                       len(bundle.fingerprints), len(bundle.torrents)) + zlib.compress(bytes(payload), 6)
+    return data + hashlib.sha256(data).digest()
+
+
+def decode(data: bytes) -> Bundle:
+    """
+    Raises:
+        ValueError: 不是导出包、版本不支持或者内容损坏
+    """
+    if len(data) < HEADER.size + DIGEST_LEN or hashlib.sha256(data[:-DIGEST_LEN]).digest() != data[-DIGEST_LEN:]:
+        raise ValueError('Index bundle is truncated or corrupted')
+    magic, version, from_tid, to_tid, min_size, n_sizes, n_fps, n_torrents = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'Unsupported index bundle version {version}')
+    try:
+        payload = zlib.decompress(data[HEADER.size:-DIGEST_LEN])
+    except zlib.error as e:
+        raise ValueError(f'Cannot decompress index bundle: {e}')
+    off = 0
+    sizes = list(sizeindex.RECORD.iter_unpack(payload[off:off + n_sizes * sizeindex.RECORD.size]))
+    off += n_sizes * sizeindex.RECORD.size
+    fps = []
+    for record in fingerprint.RECORD.iter_unpack(payload[off:off + n_fps * fingerprint.RECORD.size]):
+        fps.append((record[0], Fingerprint(record[1], record[2], tuple(size for size in record[3:] if size))))
+    off += n_fps * fingerprint.RECORD.size
+    torrents = []
+    for _ in range(n_torrents):
+        tid, total, indexed, info_hash, n = fileindex.TORRENT.unpack_from(payload, off)
+        off += fileindex.TORRENT.size
+        files = list(fileindex.FILE.iter_unpack(payload[off:off + n * fileindex.FILE.size]))
+        off += n * fileindex.FILE.size
+        torrents.append((TorrentEntry(tid, total, indexed, info_hash), files))
+    if off != len(payload):
+        raise ValueError('Index bundle has unexpected trailing data')
+    return Bundle(from_tid, to_tid, min_size, sizes, fps, torrents)
+
+
+def merge(bundle: Bundle, size_index: SizeIndex, fingerprints: FingerprintIndex,
+          file_index: Optional[FileSizeIndex]) -> tuple[int, int, int]:
+    """
+    把导出包中的记录追加到本地索引，已有的记录跳过，返回新增的体积记录数、指纹数和文件体积索引的种子数。
+
+    本地的 min_size 比导出包的大时只收录不小于本地 min_size 的文件；比导出包的小时，
+    导出包里没有的小文件不会被收录，这些种子只是少了一些可以投票的文件
+    """
+    added_sizes = size_index.add_many(bundle.sizes)
+    added_fps = fingerprints.add_many(bundle.fingerprints)
+    added_torrents = 0
+    if file_index is not None and bundle.min_size:
+        torrents = bundle.torrents
+        if file_index.min_size > bundle.min_size:
+            torrents = []
+            for entry, files in bundle.torrents:
+                files = [file for file in files if file[0] >= file_index.min_size]
+                torrents.append((entry._replace(indexed=sum(size for size, _ in files)), files))
+        added_torrents = file_index.add_many(torrents)
+    return added_sizes, added_fps, added_torrents
@@ -0,0 +1,170 @@
+"""
+按种子中的目录结构用硬链接(或者 reflink)重建本地文件，种子添加到链接所在的目录后不需要在客户端中重命名。
+
+链接和原文件需要在同一个文件系统，硬链接不占用额外空间；reflink 需要文件系统支持(btrfs、xfs 等)，
+之后修改其中一个不会影响另一个。无法创建链接时删除已经创建的链接，由调用方改用重命名。
+
+reflink 创建后把 mtime 设为和原文件相同，再次执行时体积、mtime 和开头结尾的内容都相同才当作已经创建过的链接，
+link_folder 中其他种子同名同体积的文件不会被误用。
+"""
+import asyncio
+import errno
+import os
+import stat
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+# Linux 的 FICLONE ioctl
+FICLONE = 0x40049409
+# 线程池中每个任务创建的链接数
+CHUNK_SIZE = 256
+# 比较 reflink 和原文件时读取的开头和结尾的字节数
+SAMPLE_SIZE = 1024 ** 2
+
+Link = tuple[str, str]  # 本地文件, 链接
+
+
+def plan_links(root: str, info: dict[bytes, Any], local_files: list[Optional[str]],
+               decode_name: Callable[[bytes], str]) -> list[Link]:
+    """
+    Args:
+        root: 链接所在的目录，种子添加时的保存路径
+        info: 多文件种子的 info 字典
+        local_files: 种子中每个文件对应的本地文件，没有对应的不创建链接
+        decode_name: 解码种子中的文件名
+    Raises:
+        ValueError: 种子中的路径为空、是 . 或 ..、包含路径分隔符或者无法解码，链接可能落在 root 之外
+    """
+    name = _component(decode_name(info[b'name']))
+    links = []
+    for file, local_file in zip(info[b'files'], local_files):
+        if local_file is not None:
+            links.append((local_file, os.path.join(root, name, *(_component(decode_name(part))
+                                                                for part in file[b'path']))))
+    return links
+
+
+def _component(name: str) -> str:
+    if name in ('', '.', '..') or '/' in name or os.sep in name or '\0' in name or (
+            os.altsep and os.altsep in name):
+        raise ValueError(f'Invalid path component {name!r} in torrent')
+    return name
+
+
+def _reflink(src: str, dst: str):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform', dst)
+
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    src_stat = os.stat(src)
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+
+def _same_samples(src: str, dst: str, size: int) -> bool:
+    """
+    比较两个文件开头和结尾的 SAMPLE_SIZE 字节
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'rb') as fdst:
+        for offset in sorted({0, max(0, size - SAMPLE_SIZE)}):
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            if fsrc.read(SAMPLE_SIZE) != fdst.read(SAMPLE_SIZE):
+                return False
+    return True
+
+
+def _exists(src: str, dst: str, mode: str) -> bool:
+    """
+    之前已经创建过同样的链接时返回 True，是其他文件时抛出 FileExistsError
+    """
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.stat(src)
+    if mode == 'hardlink':
+        if os.path.samestat(src_stat, dst_stat):
+            return True
+    elif (stat.S_ISREG(dst_stat.st_mode) and dst_stat.st_size == src_stat.st_size
+          and dst_stat.st_mtime_ns == src_stat.st_mtime_ns and _same_samples(src, dst, src_stat.st_size)):
+        return True
+    raise FileExistsError(errno.EEXIST, 'A different file exists', dst)
+
+
+def make_links(links: list[Link], mode: str) -> tuple[list[str], Optional[OSError]]:
+    """
+    创建链接，文件夹需要已经存在。遇到错误时停止，返回已经创建的链接和错误
+    """
+    created = []
+    for src, dst in links:
+        try:
+            if _exists(src, dst, mode):
+                continue
+            if mode == 'reflink':
+                _reflink(src, dst)
+            else:
+                os.link(src, dst)
+        except OSError as e:
+            return created, e
+        created.append(dst)
+    return created, None
+
+
+def remove_links(created: list[str], dirs: list[str]):
+    """
+    删除创建的链接和新建的空文件夹
+    """
+    for path in created:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    for path in sorted(dirs, key=len, reverse=True):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+
+def _make_dirs(links: list[Link], created: list[str]):
+    """
+    创建链接所在的文件夹，新建的文件夹加入 created
+    """
+    for path in sorted({os.path.dirname(dst) for _, dst in links}):
+        missing = []
+        while path and not os.path.isdir(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for path in reversed(missing):
+            os.mkdir(path)
+            created.append(path)
+
+
+async def build_tree(links: list[Link], mode: str = 'hardlink', executor: Optional[Executor] = None):
+    """
+    在线程池中分批创建所有链接，失败时删除这次创建的链接和文件夹
+
+    Raises:
+        OSError: 无法创建链接，errno 为 EXDEV 时说明链接和文件不在同一个文件系统
+    """
+    loop = asyncio.get_running_loop()
+    dirs = []  # type: list[str]
+    try:
+        await loop.run_in_executor(executor, _make_dirs, links, dirs)
+    except OSError:
+        await loop.run_in_executor(executor, remove_links, [], dirs)
+        raise
+    results = await asyncio.gather(*(loop.run_in_executor(executor, make_links, links[i:i + CHUNK_SIZE], mode)
+                                     for i in range(0, len(links), CHUNK_SIZE)))
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        await loop.run_in_executor(executor, remove_links, [path for created, _ in results for path in created], dirs)
+        raise errors[0]
@@ -0,0 +1,134 @@
+"""
+运行过程中的计数和耗时统计。结束时输出 JSON 汇总，watch 模式下可以通过 HTTP 以 Prometheus 文本格式获取。
+
+    from utils.metrics import metrics
+
+    metrics.inc('index_hits')
+    with metrics.time('client_rpc', method='add_torrents'):
+        ...
+
+计数和耗时可能在线程池中更新，都在锁内修改。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from loguru import logger
+
+Key = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict[str, str]) -> Key:
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_key(key: Key) -> str:
+    name, labels = key
+    return name + ''.join(f'[{k}={v}]' for k, v in labels)
+
+
+def _prometheus_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # type: dict[Key, float]
+        self.timers = {}  # type: dict[Key, list[float]]  # 次数, 总耗时, 最大耗时
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        key = _key(name, labels)
+        with self.lock:
+            if (timer := self.timers.get(key)) is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self) -> dict:
+        with self.lock:
+            counters = {_format_key(key): value for key, value in sorted(self.counters.items())}
+            timers = {_format_key(key): {'count': count, 'total': round(total, 6), 'avg': round(total / count, 6),
+                                         'max': round(_max, 6)}
+                      for key, (count, total, _max) in sorted(self.timers.items())}
+        return {'started': int(self.started), 'elapsed': round(time.time() - self.started, 3),
+                'counters': counters, 'timers': timers}
+
+    def dump(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump(self.summary(), fp, ensure_ascii=False, indent=2)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        for (name, labels), value in counters:
+            lines.append(f'u2_{name}_total{_prometheus_labels(labels)} {value}')
+        for (name, labels), (count, total, _max) in timers:
+            lines.append(f'u2_{name}_seconds_count{_prometheus_labels(labels)} {count}')
+            lines.append(f'u2_{name}_seconds_sum{_prometheus_labels(labels)} {total}')
+            lines.append(f'u2_{name}_seconds_max{_prometheus_labels(labels)} {_max}')
+        lines.append(f'u2_uptime_seconds {time.time() - self.started}')
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, port: int, host: str = '0.0.0.0') -> asyncio.AbstractServer:
+        """
+        启动一个只返回 Prometheus 文本的 HTTP 服务，不管请求的路径是什么
+        """
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                # 只需要读完请求头
+                while await reader.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                body = self.prometheus().encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(f'Prometheus 指标地址 http://{host}:{port}/metrics')
+        return server
+
+
+metrics = Metrics()
+
+
+def log_summary(summary: Optional[dict] = None):
+    summary = summary or metrics.summary()
+    for key, timer in summary['timers'].items():
+        logger.info(f'{key}: {timer["count"]} 次，共 {timer["total"]:.3f}s，平均 {timer["avg"] * 1e3:.2f}ms，'
+                    f'最长 {timer["max"] * 1e3:.2f}ms')
+    for key, value in summary['counters'].items():
+        logger.info(f'{key}: {value:g}')
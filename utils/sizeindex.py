@@ -0,0 +1,228 @@
+"""
+最大文件体积 -> (种子 id, info hash) 的紧凑索引。
+
+基础段是一个只读文件，按体积排序存放三列定长数组：int64 体积、uint32 种子 id、20 字节 info hash
+(按本机字节序存放，目前只考虑小端机器)，通过 mmap 映射后二分查找，打开时不需要解析任何内容。
+更新时新增的种子追加写入增量段，增量段记录较多时再合并进基础段。
+
+    python -m utils.sizeindex resources/size_id.json resources/size_index.bin
+
+可以把旧的 size_id.json 转换为该格式。
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, Optional
+
+MAGIC = b'U2SI'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')  # magic, version, count
+RECORD = struct.Struct('<qI20s')  # size, tid, info hash
+HASH_LEN = 20
+
+
+class SizeIndex:
+    def __init__(self, path: str = 'resources/size_index.bin', compact_threshold: int = 4096):
+        """
+        Args:
+            path: 基础段路径，增量段为同目录下的 ``<path>.delta``
+            compact_threshold: 增量段记录数超过该值时，调用 compact 会合并进基础段
+        """
+        self.path = path
+        self.delta_path = f'{path}.delta'
+        self.compact_threshold = compact_threshold
+        self._file = None
+        self._mmap = None
+        self._sizes = None
+        self._tids = None
+        self._hashes = None
+        self._count = 0
+        self._delta = {}  # type: dict[int, list[tuple[int, bytes]]]
+        self._delta_count = 0
+        self._signature = ()
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            write_base(self.path, ())
+        self._signature = file_signature(self.path, self.delta_path)
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a size index file')
+        view = memoryview(self._mmap)
+        off = HEADER.size
+        self._sizes = view[off:off + 8 * count].cast('q')
+        off += 8 * count
+        self._tids = view[off:off + 4 * count].cast('I')
+        off += 4 * count
+        self._hashes = view[off:off + HASH_LEN * count]
+        self._count = count
+
+        self._delta.clear()
+        self._delta_count = 0
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, 'rb') as fp:
+                data = fp.read()
+            # 忽略崩溃时写了一半的记录
+            for size, tid, info_hash in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+                self._delta.setdefault(size, []).append((tid, info_hash))
+                self._delta_count += 1
+
+    def close(self):
+        if self._mmap is not None:
+            self._sizes.release()
+            self._tids.release()
+            self._hashes.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def reload(self) -> bool:
+        """
+        基础段或增量段被其他进程修改过时重新打开，返回是否重新打开
+        """
+        if file_signature(self.path, self.delta_path) == self._signature:
+            return False
+        self.close()
+        self._open()
+        return True
+
+    def __len__(self):
+        return self._count + self._delta_count
+
+    def __contains__(self, size: int):
+        return bool(self.get(size))
+
+    def _base_range(self, size: int) -> tuple[int, int]:
+        lo = bisect_left(self._sizes, size)
+        if lo == self._count or self._sizes[lo] != size:
+            return lo, lo
+        return lo, bisect_right(self._sizes, size, lo)
+
+    def get(self, size: int) -> list[tuple[int, str]]:
+        """
+        返回最大文件体积为 size 的所有种子，元素为 (种子 id, info hash)，没有则返回空列表。
+        更新中断后重新写入的重复记录只返回一次
+        """
+        lo, hi = self._base_range(size)
+        result = [(self._tids[i], self._hashes[i * HASH_LEN:(i + 1) * HASH_LEN].hex()) for i in range(lo, hi)]
+        if delta := self._delta.get(size):
+            result.extend((tid, info_hash.hex()) for tid, info_hash in delta)
+            result = list(dict.fromkeys(result))
+        return result
+
+    def add(self, size: int, tid: int, info_hash: str):
+        """
+        追加一条记录到增量段
+        """
+        raw_hash = bytes.fromhex(info_hash)
+        with open(self.delta_path, 'ab') as fp:
+            fp.write(RECORD.pack(size, tid, raw_hash))
+        self._delta.setdefault(size, []).append((tid, raw_hash))
+        self._delta_count += 1
+
+    def add_many(self, records: Iterable[tuple[int, int, bytes]]) -> int:
+        """
+        批量追加 (体积, 种子 id, 原始 info hash)，已经存在的记录跳过，返回追加的记录数
+        """
+        data = bytearray()
+        count = 0
+        for size, tid, raw_hash in records:
+            if (tid, raw_hash.hex()) in self.get(size):
+                continue
+            data += RECORD.pack(size, tid, raw_hash)
+            self._delta.setdefault(size, []).append((tid, raw_hash))
+            count += 1
+        if data:
+            with open(self.delta_path, 'ab') as fp:
+                fp.write(data)
+            self._delta_count += count
+        return count
+
+    def items(self) -> Iterator[tuple[int, int, bytes]]:
+        """
+        按体积顺序遍历所有记录 (体积, 种子 id, 原始 info hash)，基础段中同体积的记录排在增量段之前
+        """
+        delta = sorted((size, tid, info_hash) for size, records in self._delta.items() for tid, info_hash in records)
+        j = 0
+        for i in range(self._count):
+            size = self._sizes[i]
+            while j < len(delta) and delta[j][0] < size:
+                yield delta[j]
+                j += 1
+            yield size, self._tids[i], bytes(self._hashes[i * HASH_LEN:(i + 1) * HASH_LEN])
+        yield from delta[j:]
+
+    def compact(self, force: bool = False):
+        """
+        把增量段合并进基础段
+        """
+        if not self._delta_count or (not force and self._delta_count < self.compact_threshold):
+            return
+        records = list(dict.fromkeys(self.items()))
+        self.close()
+        write_base(self.path, records)
+        os.remove(self.delta_path)
+        self._open()
+
+
+def file_signature(*paths: str) -> tuple[Optional[tuple[int, int, int]], ...]:
+    """
+    每个文件的 (inode, 体积, 修改时间)，不存在的文件为 None。合并后基础段被替换，inode 会变化
+    """
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def write_base(path: str, records: Iterable[tuple[int, int, bytes]]):
+    """
+    写入基础段，records 需要已按体积排序，写入临时文件后原子替换
+    """
+    sizes, tids, hashes = array('q'), array('I'), bytearray()
+    for size, tid, info_hash in records:
+        sizes.append(size)
+        tids.append(tid)
+        hashes += info_hash
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(sizes)))
+        fp.write(sizes.tobytes())
+        fp.write(tids.tobytes())
+        fp.write(hashes)
+    os.replace(tmp_path, path)
+
+
+def convert_json(json_path: str, path: str):
+    """
+    把旧格式 {"体积": "tid_hash" | ["tid_hash", ...]} 的 json 文件转换为基础段
+    """
+    with open(json_path, 'r') as fp:
+        size_id = json.load(fp)
+    records = []
+    for size, tid_hashes in size_id.items():
+        if isinstance(tid_hashes, str):
+            tid_hashes = [tid_hashes]
+        for tid_hash in tid_hashes:
+            tid, info_hash = tid_hash.split('_')
+            records.append((int(size), int(tid), bytes.fromhex(info_hash)))
+    records.sort(key=lambda record: record[0])
+    write_base(path, records)
+    return len(records)
+
+
+if __name__ == '__main__':
+    _json_path = sys.argv[1] if len(sys.argv) > 1 else 'resources/size_id.json'
+    _path = sys.argv[2] if len(sys.argv) > 2 else 'resources/size_index.bin'
+    print(f'{convert_json(_json_path, _path)} records written to {_path}')
@@ -0,0 +1,71 @@
+from hashlib import sha1
+from typing import Any
+
+from config import duplicate_sizes
+from utils.bencoder import bdecode, BdecodeError
+from utils.fingerprint import Fingerprint, fingerprint
+from utils.metrics import metrics
+
+
+def get_max_size_in_torrent(info_dict: dict[bytes, Any]) -> int:
+    """
+    返回种子中最大文件的体积，也就是体积索引的键，最大体积在 duplicate_sizes 中时取第二大的体积
+    """
+    max_size = 0
+    if b'files' not in info_dict:
+        max_size = info_dict[b'length']
+    else:
+        for file in info_dict[b'files']:
+            if (size := file[b'length']) > max_size:
+                max_size = size
+
+    if max_size in duplicate_sizes:
+        _max_size = max_size
+        max_size = 0
+        if b'files' in info_dict:
+            for file in info_dict[b'files']:
+                if (size := file[b'length']) > max_size and size != _max_size:
+                    max_size = size
+
+    return max_size
+
+
+class Torrent:
+    """
+    解码一次后在各处传递的种子，保存原始内容、解码后的 info 字典和 info hash
+    """
+    __slots__ = ('content', 'info', 'info_hash')
+
+    def __init__(self, content: bytes):
+        """
+        Raises:
+            BdecodeError
+        """
+        with metrics.time('bdecode'):
+            torrent, span = bdecode(content, with_info_span=True)
+        if not span or not isinstance(torrent[b'info'], dict):
+            raise BdecodeError('Torrent has no info dict')
+        self.content = content  # type: bytes
+        self.info = torrent[b'info']  # type: dict[bytes, Any]
+        self.info_hash = sha1(memoryview(content)[span[0]:span[1]]).hexdigest()  # type: str
+
+    @property
+    def max_size(self) -> int:
+        return get_max_size_in_torrent(self.info)
+
+    @property
+    def largest_size(self) -> int:
+        """
+        最大文件的体积，不考虑 duplicate_sizes，新加入体积索引的种子以此为键
+        """
+        return self.fingerprint.top_sizes[0]
+
+    @property
+    def file_sizes(self) -> list[int]:
+        if b'files' in self.info:
+            return [file[b'length'] for file in self.info[b'files']]
+        return [self.info[b'length']]
+
+    @property
+    def fingerprint(self) -> Fingerprint:
+        return fingerprint(self.info)
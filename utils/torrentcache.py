@@ -0,0 +1,96 @@
+"""
+下载过的 .torrent 文件的本地缓存，以 info hash 为键，总大小超过上限时删除最久没有用到的文件。
+更新数据和辅种共用这个缓存，同一个种子只需要下载一次。
+"""
+import os
+import threading
+from typing import Optional
+
+
+class TorrentCache:
+    def __init__(self, folder: str, max_bytes: int):
+        """
+        Args:
+            folder: 缓存目录，文件保存为 <folder>/<hash 前两位>/<hash>.torrent
+            max_bytes: 缓存总大小上限，超过时删除最久没有读写过的文件，直到不超过上限的 90%
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None  # type: Optional[int]
+
+    def path(self, info_hash: str) -> str:
+        return os.path.join(self.folder, info_hash[:2], f'{info_hash}.torrent')
+
+    def get(self, info_hash: str) -> Optional[bytes]:
+        path = self.path(info_hash)
+        try:
+            with open(path, 'rb') as fp:
+                content = fp.read()
+            # 用 mtime 记录最近一次使用的时间，很多系统挂载时禁用了 atime
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            return None
+
+    def put(self, info_hash: str, content: bytes):
+        path = self.path(info_hash)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, _, size in self.entries())
+            else:
+                self.total_bytes += len(content)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def discard(self, info_hash: str):
+        path = self.path(info_hash)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes -= size
+
+    def entries(self) -> list[tuple[float, str, int]]:
+        """
+        返回缓存中所有文件的 (mtime, 路径, 大小)
+        """
+        entries = []
+        if not os.path.isdir(self.folder):
+            return entries
+        with os.scandir(self.folder) as it:
+            for sub in it:
+                if not sub.is_dir():
+                    continue
+                with os.scandir(sub.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.torrent'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        entries.sort()
+        total_bytes = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except FileNotFoundError:
+                pass
+        self.total_bytes = total_bytes
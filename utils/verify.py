@@ -0,0 +1,226 @@
+"""
+添加种子之前用种子中的 piece hash 校验本地文件，避免只按体积匹配错的种子在客户端里全盘校验之后才发现不对。
+
+种子中的文件按顺序首尾相连，每 piece length 字节为一个 piece，info 中的 pieces 是每个 piece 的 SHA-1。
+只有涉及的文件在本地都有对应的 piece 才能校验，其余的跳过。
+
+- sample: 只校验每个大文件完整包含的第一个和最后一个 piece，每个种子读取的数据量很少
+- full: 校验所有能校验的 piece，通过的比例作为匹配的可信度
+
+本地文件用 mmap 读取，piece 分组后在线程池中计算，hashlib 计算时会释放 GIL。
+"""
+import asyncio
+import mmap
+from concurrent.futures import Executor
+from hashlib import sha1
+from typing import Any, NamedTuple, Optional
+
+from utils.metrics import metrics
+
+HASH_LEN = 20
+# sample 模式下只抽查不小于这个体积的文件，没有这么大的文件时抽查本地最大的文件
+SAMPLE_MIN_SIZE = 64 * 1024 ** 2
+# sample 模式下每个种子最多抽查的 piece 数，优先抽查大文件
+MAX_SAMPLES = 32
+# 线程池中每个任务读取的数据量
+CHUNK_SIZE = 64 * 1024 ** 2
+
+Segment = tuple[str, int, int]  # 本地文件路径, 文件内偏移, 长度
+
+
+class Piece(NamedTuple):
+    index: int
+    segments: list[Segment]
+
+
+class VerifyResult(NamedTuple):
+    """
+    Attributes:
+        checked: 校验的 piece 数
+        passed: 校验通过的 piece 数
+        skipped: 没有校验的 piece 数，包括本地缺少文件的和 sample 模式下没有抽查的
+        checked_bytes: 校验读取的数据量
+    """
+    checked: int
+    passed: int
+    skipped: int
+    checked_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        """
+        通过的比例，没有能校验的 piece 时为 1
+        """
+        return self.passed / self.checked if self.checked else 1.0
+
+
+def _layout(info: dict[bytes, Any], local_files: list[Optional[str]]) -> list[tuple[int, int, Optional[str]]]:
+    """
+    种子中每个文件的 (起始偏移, 体积, 本地路径)
+    """
+    if b'files' in info:
+        lengths = [file[b'length'] for file in info[b'files']]
+    else:
+        lengths = [info[b'length']]
+    layout = []
+    offset = 0
+    for length, path in zip(lengths, local_files):
+        layout.append((offset, length, path))
+        offset += length
+    return layout
+
+
+def _segments(layout: list[tuple[int, int, Optional[str]]], start: int, end: int,
+              first: int) -> Optional[list[Segment]]:
+    """
+    种子中 [start, end) 对应的本地文件片段，从第 first 个文件开始找，有文件缺失时返回 None
+    """
+    segments = []
+    for i in range(first, len(layout)):
+        offset, length, path = layout[i]
+        if offset >= end:
+            break
+        if offset + length <= start or not length:
+            continue
+        if path is None:
+            return None
+        lo = max(start, offset)
+        hi = min(end, offset + length)
+        segments.append((path, lo - offset, hi - lo))
+    return segments
+
+
+def plan_pieces(info: dict[bytes, Any], local_files: list[Optional[str]], full: bool = False) -> tuple[list[Piece], int]:
+    """
+    Args:
+        info: 种子的 info 字典
+        local_files: 种子中每个文件对应的本地文件，按种子中的顺序，没有对应的为 None
+        full: 是否选出所有能校验的 piece
+
+    Returns:
+        需要校验的 piece 以及其余 piece 的数量
+    """
+    piece_length = info[b'piece length']
+    piece_count = len(info.get(b'pieces', b'')) // HASH_LEN
+    layout = _layout(info, local_files)
+    total = sum(length for _, length, _ in layout)
+    if not piece_count or not total:
+        return [], 0
+
+    if full:
+        pieces = []
+        skipped = 0
+        first = 0
+        for index in range(piece_count):
+            start = index * piece_length
+            while first < len(layout) and layout[first][0] + layout[first][1] <= start:
+                first += 1
+            if (segments := _segments(layout, start, min(start + piece_length, total), first)) is None:
+                skipped += 1
+            elif segments:
+                pieces.append(Piece(index, segments))
+        return pieces, skipped
+
+    present = [(length, offset) for offset, length, path in layout if path is not None and length]
+    present.sort(reverse=True)
+    large = [file for file in present if file[0] >= SAMPLE_MIN_SIZE] or present[:1]
+    pieces = []
+    indexes = set()
+    for length, offset in large:
+        end = offset + length
+        # 文件的第一个和最后一个 piece，跨文件的 piece 在相邻文件缺失时改用完整落在这个文件里的 piece
+        for edge, inner in ((offset // piece_length, -(-offset // piece_length)),
+                            ((end - 1) // piece_length, piece_count - 1 if end == total else end // piece_length - 1)):
+            for index in (edge, inner):
+                start = index * piece_length
+                if not (offset < start + piece_length and start < end) or index in indexes:
+                    continue
+                if segments := _segments(layout, start, min(start + piece_length, total), 0):
+                    break
+            else:
+                continue
+            if len(pieces) >= MAX_SAMPLES:
+                return pieces, piece_count - len(pieces)
+            indexes.add(index)
+            pieces.append(Piece(index, segments))
+    return pieces, piece_count - len(pieces)
+
+
+def check_pieces(pieces: list[Piece], piece_hashes: bytes) -> tuple[int, int]:
+    """
+    计算 pieces 的 SHA-1 并和种子中的比较，返回 (通过的 piece 数, 读取的数据量)。文件读取失败的 piece 算作不通过
+    """
+    maps = {}  # type: dict[str, Optional[mmap.mmap]]
+    passed = 0
+    read = 0
+    try:
+        for piece in pieces:
+            digest = sha1()
+            try:
+                for path, offset, length in piece.segments:
+                    if path not in maps:
+                        maps[path] = None
+                        with open(path, 'rb') as fp:
+                            maps[path] = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    if (mm := maps[path]) is None or offset + length > len(mm):
+                        raise OSError(f'{path} is shorter than expected')
+                    digest.update(memoryview(mm)[offset:offset + length])
+                    read += length
+            except (OSError, ValueError):
+                continue
+            if digest.digest() == piece_hashes[piece.index * HASH_LEN:(piece.index + 1) * HASH_LEN]:
+                passed += 1
+    finally:
+        for mm in maps.values():
+            if mm is not None:
+                mm.close()
+    return passed, read
+
+
+def _chunks(pieces: list[Piece]) -> list[list[Piece]]:
+    chunks = []
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += sum(length for _, _, length in piece.segments)
+        if size >= CHUNK_SIZE:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def verify(info: dict[bytes, Any], local_files: list[Optional[str]], full: bool = False,
+                 executor: Optional[Executor] = None) -> VerifyResult:
+    """
+    在线程池中校验本地文件，参数见 plan_pieces
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.time('verify', mode='full' if full else 'sample'):
+        pieces, skipped = await loop.run_in_executor(executor, plan_pieces, info, local_files, full)
+        results = await asyncio.gather(*(loop.run_in_executor(executor, check_pieces, chunk, info[b'pieces'])
+                                         for chunk in _chunks(pieces)))
+    passed = sum(passed for passed, _ in results)
+    read = sum(read for _, read in results)
+    metrics.inc('verify_pieces', len(pieces))
+    metrics.inc('verify_failed_pieces', len(pieces) - passed)
+    metrics.inc('verify_bytes', read)
+    return VerifyResult(len(pieces), passed, skipped, read)
+
+
+def local_files_for_single(info: dict[bytes, Any], path: str, size: int) -> list[Optional[str]]:
+    """
+    只有一个本地文件 path 时种子中每个文件对应的本地文件：单文件种子就是 path，
+    多文件种子中和 path 体积相同的最后一个文件对应 path(和添加时重命名的文件一致)
+    """
+    if b'files' not in info:
+        return [path]
+    local_files = [None] * len(info[b'files'])  # type: list[Optional[str]]
+    for i, file in reversed(list(enumerate(info[b'files']))):
+        if file[b'length'] == size:
+            local_files[i] = path
+            break
+    return local_files
@@ -0,0 +1,212 @@
+"""
+监视 src_path，找出新增或者有变化、并且已经不再变化的条目，供 watch 模式辅种。
+
+安装了 inotify_simple 时用 inotify 递归监视整个目录，否则(或者监视数量超过系统限制时)定期轮询 src_path 下的条目。
+一个条目收到变化后要等 settle_time 秒没有新的变化，并且前后两次扫描的文件数、总体积和每个文件的 mtime 都相同，
+才认为下载或复制已经完成。预先分配空间的客户端写入时体积不变，只能从 mtime 看出还在写入。
+"""
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = flags = None
+
+Signature = tuple[int, int, int]
+
+
+def signature(path: str) -> Signature:
+    """
+    条目的文件数、总体积和所有文件 mtime 的和，任何一个文件被写入都会改变签名。
+    和 fsscan.scan 一样不进入指向文件夹的符号链接
+    """
+    count = total = mtime = 0
+    if not os.path.isdir(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0, 0, 0
+        return 1, stat.st_size, stat.st_mtime_ns
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                stack.append(entry.path)
+                        else:
+                            stat = entry.stat()
+                            count += 1
+                            total += stat.st_size
+                            mtime += stat.st_mtime_ns
+                    except OSError:
+                        pass
+        except OSError:
+            continue
+    return count, total, mtime
+
+
+class EntryWatcher:
+    def __init__(self, root: str, settle_time: float = 10.0, poll_interval: float = 30.0):
+        """
+        Args:
+            root: 监视的目录，即 src_path
+            settle_time: 条目最后一次变化之后需要等待的时间(秒)
+            poll_interval: 不能使用 inotify 时轮询的间隔(秒)
+        """
+        self.root = root
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.inotify = None  # type: Optional[INotify]
+        self.watches = {}  # type: dict[int, str]
+        self.dirty = {}  # type: dict[str, float]
+        self.pending = {}  # type: dict[str, Signature]
+        self.seen = {}  # type: dict[str, Signature]
+        self.listing = {}  # type: dict[str, tuple[int, int]]
+        self.last_poll = 0.0
+
+    @property
+    def polling(self) -> bool:
+        return self.inotify is None
+
+    def start(self):
+        """
+        开始监视，记录 root 下现有的条目
+        """
+        self.listing = self.list_entries()
+        if INotify is None:
+            logger.info(f'未安装 inotify_simple，每 {self.poll_interval} 秒轮询一次 {self.root}')
+            return
+        self.inotify = INotify()
+        try:
+            self.add_watches(self.root)
+        except OSError as e:
+            # 一般是超过了 fs.inotify.max_user_watches
+            logger.warning(f'无法使用 inotify 监视 {self.root}，改为每 {self.poll_interval} 秒轮询一次: {e}')
+            self.inotify.close()
+            self.inotify = None
+            self.watches.clear()
+            return
+        asyncio.get_running_loop().add_reader(self.inotify.fileno(), self.read_events)
+        logger.info(f'使用 inotify 监视 {self.root}，共 {len(self.watches)} 个文件夹')
+
+    def close(self):
+        if self.inotify is not None:
+            asyncio.get_running_loop().remove_reader(self.inotify.fileno())
+            self.inotify.close()
+            self.inotify = None
+
+    def add_watches(self, path: str):
+        # MODIFY 事件很多，但只是更新条目最后变化的时间；预先分配空间的客户端写入时只有 MODIFY
+        mask = (flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+                | flags.DELETE_SELF | flags.ONLYDIR)
+        for dirpath, _, _ in os.walk(path):
+            try:
+                self.watches[self.inotify.add_watch(dirpath, mask)] = dirpath
+            except FileNotFoundError:
+                pass
+
+    def entry_name(self, path: str) -> Optional[str]:
+        """
+        返回路径所在的 src_path 下的条目名
+        """
+        rel = os.path.relpath(path, self.root)
+        if rel == '.' or rel.startswith('..'):
+            return None
+        return rel.split(os.sep, 1)[0]
+
+    def touch(self, name: str):
+        self.dirty[name] = time.monotonic()
+
+    def read_events(self):
+        for event in self.inotify.read(timeout=0):
+            if event.mask & flags.IGNORED:
+                self.watches.pop(event.wd, None)
+                continue
+            if (parent := self.watches.get(event.wd)) is None:
+                continue
+            path = os.path.join(parent, event.name) if event.name else parent
+            if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                try:
+                    self.add_watches(path)
+                except OSError as e:
+                    logger.warning(f'Cannot watch {path}: {e}')
+            if name := self.entry_name(path):
+                self.touch(name)
+
+    def list_entries(self) -> dict[str, tuple[int, int]]:
+        """
+        src_path 下所有条目的 (mtime_ns, 体积)
+        """
+        listing = {}
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    listing[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            logger.error(f'Cannot list {self.root}: {e}')
+        return listing
+
+    def poll(self):
+        """
+        轮询只能发现新增的条目和条目本身的 mtime、体积变化，文件夹深处的变化要等条目被重新扫描时才能发现
+        """
+        listing = self.list_entries()
+        for name, stat in listing.items():
+            if self.listing.get(name) != stat:
+                self.touch(name)
+        self.listing = listing
+
+    async def settle(self) -> list[str]:
+        """
+        返回已经稳定下来的条目的完整路径
+        """
+        now = time.monotonic()
+        ready = []
+        for name, last in list(self.dirty.items()):
+            if now - last < self.settle_time:
+                continue
+            path = os.path.join(self.root, name)
+            if not os.path.lexists(path):
+                self.dirty.pop(name)
+                self.pending.pop(name, None)
+                self.seen.pop(name, None)
+                continue
+            sig = await asyncio.to_thread(signature, path)
+            if self.dirty.get(name) != last:
+                # 扫描期间又有了新的变化
+                continue
+            if sig != self.pending.get(name):
+                self.pending[name] = sig
+                self.dirty[name] = time.monotonic()
+                continue
+            self.dirty.pop(name)
+            self.pending.pop(name)
+            if self.seen.get(name) != sig:
+                self.seen[name] = sig
+                ready.append(path)
+        return ready
+
+    async def changes(self) -> AsyncIterator[list[str]]:
+        """
+        不断返回新稳定下来的条目
+        """
+        tick = min(1.0, self.settle_time / 2) or 0.1
+        while True:
+            await asyncio.sleep(tick)
+            if self.polling and time.monotonic() - self.last_poll >= self.poll_interval:
+                self.last_poll = time.monotonic()
+                await asyncio.to_thread(self.poll)
+            if self.dirty and (ready := await self.settle()):
+                yield ready
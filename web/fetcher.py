@@ -0,0 +1,178 @@
+"""
+U2 请求的调度：令牌桶限速、超时、失败重试，限速根据网站的响应自动调整。
+
+成功的请求让速率和并发数线性增加，遇到 429/503 或者网站返回错误页面时两者都减半(AIMD)，
+所以速率和并发数都会稳定在网站能承受的值附近，而不是固定的值。
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+from utils.metrics import metrics
+
+
+class FetchError(Exception):
+    """
+    请求最终失败，retryable 为 False 表示资源不存在(404、410)，以后重试也不会成功
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class TokenBucket:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float = 0.05):
+        """
+        Args:
+            rate: 初始速率(请求/秒)
+            min_rate: 速率下限
+            max_rate: 速率上限
+            increase: 每个成功的请求增加的速率
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                # 桶容量为 1 秒的令牌，避免空闲之后突发大量请求
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit: int, max_limit: int):
+        """
+        同时进行的请求数上限，达到上限时每完成一轮(limit 个)成功的请求加 1，被限流时减半，不小于 1
+
+        Args:
+            limit: 初始上限
+            max_limit: 上限的最大值
+        """
+        self.limit = float(min(limit, max_limit))
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self.cond:
+            self.in_flight -= 1
+            # 上限可能在请求期间增加了，唤醒所有等待的请求重新检查
+            self.cond.notify_all()
+
+    def on_success(self):
+        # 只有上限真正限制了并发(刚完成的请求算在内)时才增加，速率受令牌桶限制时上限不会一直涨上去
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttled(self):
+        self.limit = max(1.0, self.limit / 2)
+
+
+class Fetcher:
+    def __init__(self, concurrency: int, max_concurrency: int, rate: float, min_rate: float, max_rate: float,
+                 timeout: float, retries: int):
+        """
+        Args:
+            concurrency: 初始的同时进行的请求数，之后在 [1, max_concurrency] 之间自动调整
+            rate: 初始速率(请求/秒)，之后在 [min_rate, max_rate] 之间自动调整
+            timeout: 单个请求的超时时间(秒)
+            retries: 失败后的最大重试次数
+        """
+        self.bucket = TokenBucket(rate, min_rate, max_rate)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.limit = ConcurrencyLimit(concurrency, max_concurrency)
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+
+    def bind_loop(self):
+        # 更新和辅种可能在不同的事件循环里执行，锁和条件变量不能跨循环使用
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.limit.cond = asyncio.Condition()
+            self.limit.in_flight = 0
+            self.bucket.lock = asyncio.Lock()
+
+    def on_success(self):
+        self.bucket.on_success()
+        self.limit.on_success()
+
+    def on_throttled(self):
+        self.bucket.on_throttled()
+        self.limit.on_throttled()
+        metrics.inc('fetch_concurrency_decreases')
+
+    async def get(self, session: aiohttp.ClientSession, url: str, torrent: bool = False, **kwargs) -> bytes:
+        """
+        GET 请求，返回响应内容。torrent 为 True 时，返回 html 页面视为网站出错
+
+        Raises:
+            FetchError
+        """
+        self.bind_loop()
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # 指数退避加随机抖动
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                logger.debug(f'Retry {url} in {delay:.1f}s ({error})')
+                metrics.inc('fetch_retries')
+                await asyncio.sleep(delay)
+            # 先取令牌再占用并发数，等待令牌的请求不算在进行中的请求里
+            await self.bucket.acquire()
+            async with self.limit:
+                start = time.perf_counter()
+                try:
+                    async with session.get(url, timeout=self.timeout, **kwargs) as resp:
+                        content = await resp.read()
+                        status = resp.status
+                        content_type = resp.content_type
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    metrics.inc('fetch_errors', error=type(e).__name__)
+                    error = FetchError(f'{type(e).__name__}: {e}')
+                    continue
+                metrics.observe('fetch', time.perf_counter() - start, kind='torrent' if torrent else 'page')
+                metrics.inc('fetch_bytes', len(content))
+            if status == 429 or status >= 500:
+                metrics.inc('fetch_throttled', status=str(status))
+                self.on_throttled()
+                error = FetchError(f'HTTP {status}')
+                continue
+            if status >= 400:
+                # 其他 4xx 也不在这里重试，但可能是 cookie、passkey 之类的问题，下次更新时还要再试
+                raise FetchError(f'HTTP {status}', retryable=status not in (404, 410))
+            if torrent and (content_type == 'text/html' or content.lstrip()[:1] == b'<'):
+                self.on_throttled()
+                error = FetchError('Got an html page instead of a .torrent file')
+                continue
+            self.on_success()
+            return content
+        raise error
@@ -0,0 +1,147 @@
+"""
+在多个节点之间共享索引：一个节点更新数据后导出，其他节点导入，不需要各自访问网站、下载同样的种子。
+
+导出目录中有一个 manifest.json 和若干导出包(见 utils.indexbundle)：
+
+    {"version": 1, "newest_tid": 60000,
+     "snapshot": {"file": "snapshot-59000.u2b", "from_tid": 0, "to_tid": 59000, "sha256": "...", "bytes": 123},
+     "deltas": [{"file": "delta-59000-60000.u2b", "from_tid": 59000, "to_tid": 60000, ...}, ...]}
+
+导出目录可以直接作为共享目录，或者用任意静态 HTTP 服务器提供(比如 python -m http.server)。
+导入时从本地的 newest_tid 开始依次应用首尾相接的增量包，增量包接不上时先导入快照。
+
+更新时重试成功的旧种子 id 不在新的增量包的范围内，要等下一次导出快照时才会被其他节点导入。
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import Optional
+
+from loguru import logger
+
+from utils import indexbundle
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def load_manifest(folder: str) -> dict:
+    path = os.path.join(folder, MANIFEST)
+    if not os.path.exists(path):
+        return {'version': MANIFEST_VERSION, 'newest_tid': 0, 'snapshot': None, 'deltas': []}
+    with open(path, 'r', encoding='utf-8') as fp:
+        manifest = json.load(fp)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'Unsupported manifest version {manifest.get("version")}')
+    return manifest
+
+
+def write_bundle(folder: str, name: str, bundle: indexbundle.Bundle) -> dict:
+    data = indexbundle.encode(bundle)
+    path = os.path.join(folder, name)
+    with open(f'{path}.tmp', 'wb') as fp:
+        fp.write(data)
+    os.replace(f'{path}.tmp', path)
+    return {'file': name, 'from_tid': bundle.from_tid, 'to_tid': bundle.to_tid,
+            'sha256': hashlib.sha256(data).hexdigest(), 'bytes': len(data)}
+
+
+def export_index(update, folder: str, snapshot: bool = False) -> Optional[dict]:
+    """
+    把上次导出之后新增的种子导出为增量包；还没有快照或者 snapshot 为 True 时导出完整的快照。
+    返回新导出包在 manifest 中的记录，没有新的种子时返回 None
+    """
+    os.makedirs(folder, exist_ok=True)
+    manifest = load_manifest(folder)
+    newest_tid = update.newest_tid
+    if snapshot or not manifest['snapshot']:
+        bundle = indexbundle.collect(update.size_index, update.fingerprints, update.file_index, 0, newest_tid)
+        entry = manifest['snapshot'] = write_bundle(folder, f'snapshot-{newest_tid}.u2b', bundle)
+    elif newest_tid > manifest['newest_tid']:
+        bundle = indexbundle.collect(update.size_index, update.fingerprints, update.file_index,
+                                     manifest['newest_tid'], newest_tid)
+        entry = write_bundle(folder, f'delta-{manifest["newest_tid"]}-{newest_tid}.u2b', bundle)
+        manifest['deltas'].append(entry)
+    else:
+        return None
+    manifest['newest_tid'] = max(manifest['newest_tid'], newest_tid)
+    path = os.path.join(folder, MANIFEST)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, ensure_ascii=False, indent=2)
+    os.replace(f'{path}.tmp', path)
+    logger.info(f'导出 {entry["file"]}，种子 id {entry["from_tid"]}-{entry["to_tid"]}，'
+                f'{len(bundle.sizes)} 条体积记录，{entry["bytes"]} 字节')
+    return entry
+
+
+def plan_import(manifest: dict, local_tid: int) -> list[dict]:
+    """
+    返回从 local_tid 更新到 manifest 中最新的种子需要依次导入的包
+    """
+    deltas = manifest['deltas']
+    snapshot = manifest['snapshot']
+    plan = []
+    current = local_tid
+    if snapshot and snapshot['to_tid'] > current and not any(
+            delta['from_tid'] <= current < delta['to_tid'] for delta in deltas):
+        plan.append(snapshot)
+        current = snapshot['to_tid']
+    while best := max((delta for delta in deltas if delta['from_tid'] <= current < delta['to_tid']),
+                      key=lambda delta: delta['to_tid'], default=None):
+        plan.append(best)
+        current = best['to_tid']
+    return plan
+
+
+async def read_source(session, source: str, name: str) -> bytes:
+    """
+    从 HTTP 地址或者共享目录读取文件
+    """
+    if source.startswith(('http://', 'https://')):
+        async with session.get(f'{source.rstrip("/")}/{name}') as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    def read():
+        with open(os.path.join(source, name), 'rb') as fp:
+            return fp.read()
+
+    return await asyncio.to_thread(read)
+
+
+async def import_index(update, source: str) -> int:
+    """
+    从其他节点导出的目录导入新的种子，更新 update.newest_tid，返回导入到的最新种子 id
+
+    Raises:
+        ValueError: manifest 或者导出包版本不支持、校验失败
+    """
+    import aiohttp
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        manifest = json.loads(await read_source(session, source, MANIFEST))
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f'Unsupported manifest version {manifest.get("version")}')
+        if manifest['newest_tid'] <= update.newest_tid:
+            logger.info(f'{source} 中最新的种子 id 为 {manifest["newest_tid"]}，本地的索引已经是最新的')
+            return update.newest_tid
+        if not (plan := plan_import(manifest, update.newest_tid)):
+            logger.warning(f'{source} 中没有能接上本地种子 id {update.newest_tid} 的导出包')
+            return update.newest_tid
+        for entry in plan:
+            data = await read_source(session, source, entry['file'])
+            if hashlib.sha256(data).hexdigest() != entry['sha256']:
+                raise ValueError(f'Checksum of {entry["file"]} does not match manifest')
+            bundle = await asyncio.to_thread(indexbundle.decode, data)
+            added = await asyncio.to_thread(indexbundle.merge, bundle, update.size_index, update.fingerprints,
+                                            update.file_index)
+            update.newest_tid = max(update.newest_tid, bundle.to_tid)
+            update.save_newest_tid()
+            logger.info(f'导入 {entry["file"]}，新增 {added[0]} 条体积记录、{added[1]} 个指纹、'
+                        f'{added[2]} 个文件体积索引的种子')
+    update.size_index.compact()
+    update.fingerprints.compact()
+    if update.file_index is not None:
+        update.file_index.compact()
+    return update.newest_tid
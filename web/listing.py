@@ -0,0 +1,64 @@
+"""
+解析 U2 种子列表页(torrents.php)，取出每一行的种子 id、体积和是否置顶。
+
+直接用 lxml 解析，用预先编译的 XPath 取值，不构建 BeautifulSoup 树，也不把每一行重新序列化成字符串。
+置顶只看行和图片的 class、图片地址，标题里出现 sticky 的种子不会被误判为置顶。
+"""
+import re
+from typing import NamedTuple
+
+from lxml import etree
+
+_parser = etree.HTMLParser(encoding='utf-8', remove_comments=True, remove_blank_text=True)
+# 只取列表的直接子行，标题单元格里嵌套的表格不算
+_table = etree.XPath("boolean(//table[contains(concat(' ', normalize-space(@class), ' '), ' torrents ')])")
+_rows = etree.XPath("(//table[contains(concat(' ', normalize-space(@class), ' '), ' torrents ')])[1]"
+                    "/tr | (//table[contains(concat(' ', normalize-space(@class), ' '), ' torrents ')])[1]/tbody/tr")
+_detail_href = etree.XPath("(.//a[contains(@href, 'details.php?id=')])[1]/@href")
+# 只看行和图片的 class、图片地址，标题(title 属性和文本)里出现 sticky 不算
+_sticky = etree.XPath("boolean(self::*[contains(@class, 'sticky')]"
+                      " | .//img[contains(@class, 'sticky') or contains(@src, 'sticky')])")
+_tid_re = re.compile(r'[?&]id=(\d+)')
+_size_re = re.compile(r'^([\d.]+)\s*([KMGTPE]?i?B)$')
+_units = {'B': 0, 'KB': 1, 'MB': 2, 'GB': 3, 'TB': 4, 'PB': 5, 'EB': 6}
+
+
+class ListingRow(NamedTuple):
+    tid: int
+    size: int  # 列表页上显示的体积，只保留了几位有效数字，0 表示没有找到
+    sticky: bool
+
+
+def parse_size(text: str) -> int:
+    if not (m := _size_re.match(text)):
+        return 0
+    return int(float(m[1]) * 1024 ** _units[m[2].replace('i', '')])
+
+
+def parse_listing(page: bytes) -> list[ListingRow]:
+    """
+    返回列表页中所有种子的行，跳过表头和取不到种子 id 的行
+
+    Raises:
+        ValueError: 页面中没有种子列表，比如 cookie 失效后返回的登录页
+    """
+    root = etree.fromstring(page, _parser)
+    if root is None or not _table(root):
+        raise ValueError('page has no torrents table')
+    rows = []
+    for tr in _rows(root):
+        if not (href := _detail_href(tr)) or not (m := _tid_re.search(href[0])):
+            continue
+        size = 0
+        for td in tr.iterchildren('td'):
+            # 体积单元格形如 1.23<br>GiB，只看没有其他子元素的单元格，不用遍历标题里的内容
+            if len(td) == 1 and td[0].tag == 'br':
+                text = f'{td.text or ""}{td[0].tail or ""}'
+            elif not len(td):
+                text = td.text or ''
+            else:
+                continue
+            if size := parse_size(text.strip()):
+                break
+        rows.append(ListingRow(int(m[1]), size, _sticky(tr)))
+    return rows
@@ -1,127 +1,323 @@
 import asyncio
 import json
-from hashlib import sha1
-from typing import Any
+import os
+from typing import Optional
 
-import aiohttp
-from bs4 import BeautifulSoup
 from loguru import logger
 
-from config import cookies, passkey, proxy, headers, duplicate_sizes
-from utils.bencoder import bencode, bdecode
-
-
-logger.add(level='DEBUG', sink=f'logs/update-{{time}}.log')
+from config import (cookies, passkey, proxy, headers, update_workers, update_checkpoint_interval, fetch_rate,
+                    fetch_min_rate, fetch_max_rate, fetch_max_concurrency, fetch_timeout, fetch_retries, torrent_cache_folder,
+                    torrent_cache_size, file_index_min_size, index_source, index_export_folder)
+from utils.bencoder import BdecodeError
+from utils.fileindex import FileSizeIndex
+from utils.fingerprint import FingerprintIndex
+from utils.metrics import metrics
+from utils.torrent import Torrent
+from utils.sizeindex import SizeIndex
+from utils.torrentcache import TorrentCache
 
 
 class Update:
+    """
+    aiohttp、lxml 等只有访问网站时才需要的依赖在用到时才导入，只用本地索引辅种时启动更快
+    """
+
     def __init__(self):
         self.base_url = 'https://u2.dmhy.org/torrents.php'
         self.page_index = 0
-        self.sem = asyncio.Semaphore(5)
+        self._fetcher = None
         self.end = False
-        self.tid_list = []
         with open('resources/newest_tid', 'r') as f:
             self.newest_tid = int(f.read())
-        with open('resources/size_id.json', 'r') as fp:
-            self.size_id = json.load(fp)
-        self.tid_updated = False
+        self.size_index = SizeIndex('resources/size_index.bin')
+        self.fingerprints = FingerprintIndex('resources/fingerprint.bin')
+        self.file_index = FileSizeIndex('resources/file_index.bin', file_index_min_size) if file_index_min_size else None
         self.session = None
         self.old_tid = self.newest_tid
+        self.state_path = 'resources/update_state.json'
+        self.done = set()  # type: set[int]
+        self.torrent_cache = TorrentCache(torrent_cache_folder, torrent_cache_size) if torrent_cache_folder else None
+        self.failed_path = 'resources/failed_tids'
+        self.failed = set()  # type: set[int]
+        # 这次更新从其他节点导入的种子 id 范围 (from_tid, to_tid]，翻页时跳过
+        self.imported = (0, 0)
+
+    @property
+    def fetcher(self):
+        if self._fetcher is None:
+            from web.fetcher import Fetcher
+            self._fetcher = Fetcher(update_workers, fetch_max_concurrency, fetch_rate, fetch_min_rate, fetch_max_rate,
+                                    fetch_timeout, fetch_retries)
+        return self._fetcher
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    def save_newest_tid(self):
+        with open('resources/newest_tid.tmp', 'w') as f:
+            f.write(str(self.newest_tid))
+        os.replace('resources/newest_tid.tmp', 'resources/newest_tid')
+
+    def load_failed(self):
+        if os.path.exists(self.failed_path):
+            with open(self.failed_path, 'r') as fp:
+                self.failed = {int(line) for line in fp if line.strip()}
+
+    def save_failed(self):
+        with open(f'{self.failed_path}.tmp', 'w') as fp:
+            fp.writelines(f'{tid}\n' for tid in sorted(self.failed))
+        os.replace(f'{self.failed_path}.tmp', self.failed_path)
+
+    def load_checkpoint(self):
+        """
+        上次更新中断时，从上次的起点继续，已经写入索引的种子不再下载
+        """
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, 'r') as fp:
+            state = json.load(fp)
+        self.old_tid = state['old_tid']
+        self.newest_tid = max(self.newest_tid, state['newest_tid'])
+        self.done = set(state['done'])
+        self.imported = tuple(state.get('imported', (0, 0)))
+        logger.info(f'继续上次中断的更新，已完成 {len(self.done)} 个种子')
+
+    def save_checkpoint(self):
+        state = {'old_tid': self.old_tid, 'newest_tid': self.newest_tid, 'done': sorted(self.done),
+                 'imported': self.imported}
+        with open(f'{self.state_path}.tmp', 'w') as fp:
+            json.dump(state, fp)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
+        self.save_failed()
 
     async def main(self):
+        """
+        翻页和下载种子同时进行：翻页得到的种子 id 放入有界队列，worker 下载、解码、写入索引后立即丢弃，
+        每完成 update_checkpoint_interval 个种子保存一次进度，中断后再次更新会从断点继续。
+        下载失败的种子记录在 failed_tids 中，下次更新时最先重试；已经不存在(404)的种子直接丢弃
+        """
+        import aiohttp
+
         logger.info('开始更新数据')
+        self.load_checkpoint()
+        self.load_failed()
+        if index_source:
+            from web.indexshare import import_index
 
-        async with aiohttp.ClientSession() as self.session:
-            tasks = []
-            while not self.end:
-                page = await self.fetch_page()
-                for tid in self.parse_page(page):
-                    tasks.append(self.fetch_torrent(tid))
-                self.page_index += 1
-            await asyncio.gather(*tasks)
-        self.session = None
+            before = self.newest_tid
+            try:
+                await import_index(self, index_source)
+            except Exception as e:
+                logger.error(f'Cannot import index from {index_source}: {e}')
+            # 导入中途失败时，已经应用的包也已经更新了 newest_tid；和上次中断前导入的范围接得上时合并
+            if self.newest_tid > before:
+                self.imported = (self.imported[0] if self.imported[1] == before else before, self.newest_tid)
+            if self.old_tid >= before:
+                # 没有中断的更新时导入的种子和已有的接在一起，只需要翻到导入的最新种子为止
+                self.old_tid = max(self.old_tid, self.imported[1])
+            # 否则上次中断时 (old_tid, before] 中还有没完成的种子，翻页时只跳过导入的范围
+        self.page_index = 0
+        self.end = False
+        # 同时进行的下载数由 fetcher 根据网站的响应调整，worker 数只是它的上限
+        workers_count = max(update_workers, fetch_max_concurrency)
+        queue = asyncio.Queue(maxsize=2 * workers_count)
 
-        with open('resources/size_id.json', 'w') as fp:
-            json.dump(self.size_id, fp)
+        try:
+            async with aiohttp.ClientSession() as self.session:
+                workers = [asyncio.create_task(self.consume(queue)) for _ in range(workers_count)]
+                try:
+                    await self.produce(queue)
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+        except BaseException:
+            self.save_checkpoint()
+            logger.warning(f'更新中断，已完成 {len(self.done)} 个种子，下次更新会从断点继续')
+            raise
+        finally:
+            self.session = None
+
+        self.save_newest_tid()
+        self.save_failed()
+        if self.failed:
+            logger.warning(f'{len(self.failed)} 个种子下载失败，下次更新时会重试')
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self.old_tid = self.newest_tid
+        self.done.clear()
+        self.imported = (0, 0)
+        self.size_index.compact()
+        self.fingerprints.compact()
+        if self.file_index is not None:
+            self.file_index.compact()
 
         logger.info(f'更新数据完毕，最新种子 id 为 {self.newest_tid}')
+        if index_export_folder:
+            from web.indexshare import export_index
+
+            await asyncio.to_thread(export_index, self, index_export_folder)
+
+    async def produce(self, queue: asyncio.Queue):
+        """
+        Raises:
+            FetchError: 列表页中没有种子列表，通常是 cookie 失效，这时更新不能当作完成
+        """
+        from web.fetcher import FetchError
 
-    def parse_page(self, page: str):
-        soup = BeautifulSoup(page.replace('\n', ''), 'lxml')
-        table = soup.select('table.torrents')[0]
-        for tr in table.contents[1:]:
-            if 'sticky' not in str(tr):
-                tid = int(tr.contents[1].a['href'][15:-6])
-                if not self.tid_updated:
-                    with open('resources/newest_tid', 'w') as f:
-                        f.write(str(tid))
-                    self.newest_tid = tid
-                    self.tid_updated = True
-                if tid == self.old_tid:
+        if self.failed:
+            logger.info(f'重试上次下载失败的 {len(self.failed)} 个种子')
+        for tid in sorted(self.failed):
+            await queue.put(tid)
+        while not self.end:
+            page = await self.fetch_page()
+            # 解析是纯 CPU 的工作，放到线程里，不影响同时进行的种子下载
+            try:
+                tids = await asyncio.to_thread(self.parse_page, page)
+            except ValueError as e:
+                raise FetchError(f'Cannot parse page {self.page_index}, cookies may have expired: {e}') from e
+            if not tids:
+                break
+            for tid in tids:
+                self.newest_tid = max(self.newest_tid, tid)
+                if tid <= self.old_tid:
                     self.end = True
                     break
-                else:
-                    yield tid
-
-    async def fetch_page(self):
-        async with self.sem:
-            async with self.session.get(
-                f'{self.base_url}?page={self.page_index}',
-                cookies=cookies,
-                headers=headers,
-                proxy=proxy
-            ) as resp:
-                return await resp.text()
-
-    async def fetch_torrent(self, torrent_id):
+                if self.imported[0] < tid <= self.imported[1]:
+                    continue
+                if tid not in self.done and tid not in self.failed:
+                    await queue.put(tid)
+            self.page_index += 1
+
+    async def consume(self, queue: asyncio.Queue):
+        from web.fetcher import FetchError
+
+        while (tid := await queue.get()) is not None:
+            try:
+                indexed = await self.index_torrent(tid)
+            except FetchError as e:
+                logger.warning(f'Torrent {tid} no longer exists ({e}), it will not be retried')
+                metrics.inc('update_dropped')
+                self.failed.discard(tid)
+                continue
+            except Exception as e:
+                # worker 不能因为一个种子退出，否则 worker 全部退出后 produce 会一直阻塞在有界队列上
+                logger.opt(exception=e).error(f'Cannot index torrent {tid}: {e}')
+                indexed = False
+            if indexed:
+                self.done.add(tid)
+                self.failed.discard(tid)
+                if len(self.done) % update_checkpoint_interval == 0:
+                    try:
+                        self.save_checkpoint()
+                    except OSError as e:
+                        logger.error(f'Cannot save update checkpoint: {e}')
+            else:
+                self.failed.add(tid)
+
+    @staticmethod
+    def parse_page(page: bytes) -> list[int]:
+        """
+        返回列表页中不是置顶的种子 id
+        """
+        from web.listing import parse_listing
+
+        with metrics.time('parse_page'):
+            return [row.tid for row in parse_listing(page) if not row.sticky]
+
+    async def fetch_page(self) -> bytes:
+        return await self.fetcher.get(
+            self.session,
+            f'{self.base_url}?page={self.page_index}',
+            cookies=cookies,
+            headers=headers,
+            proxy=proxy or None
+        )
+
+    async def fetch_torrent(self, torrent_id, raise_missing: bool = False) -> Optional[Torrent]:
+        """
+        下载并解码种子，失败时返回 None
+
+        Raises:
+            FetchError: raise_missing 为 True 并且种子已经不存在(retryable 为 False)
+        """
+        import aiohttp
+        from web.fetcher import FetchError
+
         download_link = f'https://u2.dmhy.org/download.php?id={torrent_id}&passkey={passkey}&https=1'
-        async with self.sem:
-            if not self.session:
-                self.session = aiohttp.ClientSession()
-            async with self.session.get(download_link, headers=headers, proxy=proxy) as resp:
-                content = await resp.read()
-                self.update_size_id(torrent_id, content)
-        return content
-
-    def update_size_id(self, torrent_id: int, content: bytes):
+        if not self.session:
+            self.session = aiohttp.ClientSession()
         try:
-            torrent = bdecode(content)  # 解码后的种子内容
-        except:
+            content = await self.fetcher.get(self.session, download_link, torrent=True, headers=headers,
+                                             proxy=proxy or None)
+        except FetchError as e:
+            if raise_missing and not e.retryable:
+                raise
+            logger.error(f'Cannot download .torrent file of torrent {torrent_id}: {e}')
             return
-        info_dict = torrent[b'info']  # info 字典
-        info_hash = sha1(bencode(info_dict)).hexdigest()  # info hash v1
-        tid_hash = f'{torrent_id}_{info_hash}'
-        max_size = self.get_max_size_in_torrent(info_dict)
-
-        if max_size not in self.size_id:
-            self.size_id[max_size] = tid_hash
-        else:
-            _tid_hash = self.size_id[max_size]
-            if isinstance(_tid_hash, str):
-                self.size_id[max_size] = [_tid_hash, tid_hash]
-            else:
-                _tid_hash.append(tid_hash)
+        try:
+            torrent = Torrent(content)
+        except BdecodeError:
+            logger.error(f'Cannot decode .torrent file of torrent {torrent_id}')
+            return
+        if self.torrent_cache:
+            await asyncio.to_thread(self.torrent_cache.put, torrent.info_hash, content)
+        # 辅种时下载的旧种子也记录指纹，以后不用再下载就能排除
+        self.fingerprints.add(torrent.info_hash, torrent.fingerprint)
+        return torrent
 
-    @staticmethod
-    def get_max_size_in_torrent(info_dict: dict[bytes, Any]) -> str:
-        max_size = 0
-        if b'files' not in info_dict:
-            max_size = info_dict[b'length']
-        else:
-            for file in info_dict[b'files']:
-                if (size := file[b'length']) > max_size:
-                    max_size = size
-
-        if max_size in duplicate_sizes:
-            _max_size = max_size
-            max_size = 0
-            if b'files' in info_dict:
-                for file in info_dict[b'files']:
-                    if (size := file[b'length']) > max_size and size != _max_size:
-                        max_size = size
-
-        return str(max_size)
-
-
-update = Update()
+    def get_cached_torrent(self, info_hash: str) -> Optional[Torrent]:
+        """
+        从本地缓存读取种子，内容损坏或者 info hash 不一致时删除缓存
+        """
+        if not self.torrent_cache or not (content := self.torrent_cache.get(info_hash)):
+            return
+        try:
+            torrent = Torrent(content)
+            if torrent.info_hash == info_hash:
+                return torrent
+        except BdecodeError:
+            pass
+        self.torrent_cache.discard(info_hash)
+
+    async def index_torrent(self, torrent_id) -> bool:
+        """
+        Raises:
+            FetchError: 种子已经不存在
+        """
+        if torrent := await self.fetch_torrent(torrent_id, raise_missing=True):
+            self.update_size_id(torrent_id, torrent)
+            return True
+        return False
+
+    def reload(self) -> bool:
+        """
+        常驻运行时重新打开其他进程(比如定时执行的 update)修改过的索引文件，返回是否有索引被重新打开
+        """
+        reloaded = [self.size_index.reload(), self.fingerprints.reload()]
+        if self.file_index is not None:
+            reloaded.append(self.file_index.reload())
+        return any(reloaded)
+
+    def update_size_id(self, torrent_id: int, torrent: Torrent):
+        # 有了指纹之后不再需要 duplicate_sizes，以真正的最大体积为键
+        self.size_index.add(torrent.largest_size, int(torrent_id), torrent.info_hash)
+        if self.file_index is not None:
+            self.file_index.add(int(torrent_id), torrent.info_hash, torrent.file_sizes)
+
+
+_update = None  # type: Optional[Update]
+
+
+def get_update() -> Update:
+    """
+    第一次用到时才创建 Update，打开索引文件
+    """
+    global _update
+    if _update is None:
+        _update = Update()
+    return _update